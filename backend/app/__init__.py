@@ -1,6 +1,7 @@
 import os
 import sys
-from flask import Flask, send_from_directory
+import click
+from flask import Flask, jsonify, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
@@ -9,7 +10,7 @@ from dotenv import load_dotenv
 from sqlalchemy import create_engine, text, inspect
 from flask_mailman import Mail
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from .ratelimit import rate_limit_key
 
 # 環境変数読み込み
 load_dotenv(".env.local")
@@ -19,7 +20,8 @@ db = SQLAlchemy()
 migrate = Migrate()
 bcrypt = Bcrypt()
 mail = Mail()
-limiter = Limiter(key_func=get_remote_address, default_limits=["200 per day", "50 per hour"], storage_uri="memory://")
+# カウンタの保存先は create_app で RATELIMIT_STORAGE_URI に設定する（app/ratelimit.py）
+limiter = Limiter(key_func=rate_limit_key, default_limits=["200 per day", "50 per hour"])
 
 def create_app():
     """Application-factory function"""
@@ -100,8 +102,65 @@ def create_app():
         MAIL_PASSWORD=os.getenv('MAIL_PASSWORD'),
         MAIL_USE_TLS=os.getenv('MAIL_USE_TLS', 'True') == 'True',
         MAIL_DEFAULT_SENDER=os.getenv('MAIL_DEFAULT_SENDER', 'noreply@example.com'),
+
+        # Rate Limit Settings（app/ratelimit.py）
+        # 既定は instance/ratelimit.db を全ワーカーで共有する。memory:// ならワーカーごとに数える
+        RATELIMIT_STORAGE_URI=os.getenv('RATELIMIT_STORAGE_URI', f"sqlite:///{os.path.join(app.instance_path, 'ratelimit.db')}"),
+        RATELIMIT_KEY_BY_USER=os.getenv('RATELIMIT_KEY_BY_USER', 'False') == 'True',
+
+        # Cache Settings（app/cache.py）
+        # 他のワーカー・サーバーでの更新を反映するまでの最大秒数（0 ならキャッシュの確認ごとに DB を読む）
+        DATA_VERSION_TTL=float(os.getenv('DATA_VERSION_TTL', 1.0)),
+
+        # Mail Outbox Settings（app/outbox.py）
+        # 送信スレッドを動かすワーカーか（False のワーカーはキューに積むだけで、送信は True のワーカーが拾う）
+        OUTBOX_SENDER=os.getenv('OUTBOX_SENDER', 'False') == 'True',
+        OUTBOX_BATCH_SIZE=int(os.getenv('OUTBOX_BATCH_SIZE', 20)),
+        OUTBOX_POLL_INTERVAL=float(os.getenv('OUTBOX_POLL_INTERVAL', 5)),
+        OUTBOX_MAX_ATTEMPTS=int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6)),
+        OUTBOX_RETRY_BASE=float(os.getenv('OUTBOX_RETRY_BASE', 30)),
+
+        # Password Hashing Settings（app/passwords.py）
+        BCRYPT_LOG_ROUNDS=int(os.getenv('BCRYPT_LOG_ROUNDS', 12)),
+        PASSWORD_POOL_WORKERS=int(os.getenv('PASSWORD_POOL_WORKERS', os.cpu_count() or 1)),
+        PASSWORD_QUEUE_LIMIT=int(os.getenv('PASSWORD_QUEUE_LIMIT')) if os.getenv('PASSWORD_QUEUE_LIMIT') else None,
+        PASSWORD_TIMEOUT=float(os.getenv('PASSWORD_TIMEOUT', 10)),
+
+        # Upload Settings（app/uploads.py, app/storage.py）
+        # 保存先は local（app/static/uploads）か s3（S3 互換のオブジェクトストレージ、複数台構成用）
+        UPLOAD_STORAGE=os.getenv('UPLOAD_STORAGE', 'local'),
+        S3_ENDPOINT_URL=os.getenv('S3_ENDPOINT_URL'),
+        S3_PUBLIC_ENDPOINT_URL=os.getenv('S3_PUBLIC_ENDPOINT_URL'),
+        S3_BUCKET=os.getenv('S3_BUCKET'),
+        S3_REGION=os.getenv('S3_REGION', 'us-east-1'),
+        S3_ACCESS_KEY_ID=os.getenv('S3_ACCESS_KEY_ID'),
+        S3_SECRET_ACCESS_KEY=os.getenv('S3_SECRET_ACCESS_KEY'),
+        S3_PREFIX=os.getenv('S3_PREFIX', 'uploads/'),
+        S3_PRESIGN_EXPIRES=int(os.getenv('S3_PRESIGN_EXPIRES', 7 * 24 * 60 * 60)),
+        # UPLOADS_SENDFILE=x-accel なら nginx、x-sendfile なら Apache 等にファイルを送らせる
+        UPLOADS_SENDFILE=os.getenv('UPLOADS_SENDFILE', ''),
+        UPLOADS_ACCEL_PREFIX=os.getenv('UPLOADS_ACCEL_PREFIX', '/_uploads/'),
+        UPLOADS_MAX_AGE=int(os.getenv('UPLOADS_MAX_AGE', 365 * 24 * 60 * 60)),
+        # 写真のアップロードは PHOTO_MAX_FILE_SIZE から上限を決め、それ以外の本文は MAX_CONTENT_LENGTH まで
+        PHOTO_MAX_FILE_SIZE=int(os.getenv('PHOTO_MAX_FILE_SIZE', 20 * 1024 * 1024)),
+        MAX_CONTENT_LENGTH=int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024)),
+        # まとめてアップロードする場合の本文の上限と、縮小版を並行に作るスレッド数
+        PHOTO_BATCH_MAX_SIZE=int(os.getenv('PHOTO_BATCH_MAX_SIZE', 200 * 1024 * 1024)),
+        PHOTO_BATCH_WORKERS=int(os.getenv('PHOTO_BATCH_WORKERS', min(4, os.cpu_count() or 1))),
+        # 参照されないファイルの回収（app/upload_gc.py）。UPLOAD_GC_INTERVAL=0 なら flask gc-uploads で手動・cron 実行
+        UPLOAD_GC_MIN_AGE=int(os.getenv('UPLOAD_GC_MIN_AGE', 3600)),
+        UPLOAD_GC_INTERVAL=int(os.getenv('UPLOAD_GC_INTERVAL', 0)),
     )
 
+    # パスワード処理の待ち行列が溢れた場合は、待たせずに再試行を促す
+    from .passwords import PasswordPoolBusy
+
+    @app.errorhandler(PasswordPoolBusy)
+    def handle_password_pool_busy(e):
+        response = jsonify({'error': 'ただいま混み合っています。しばらくしてから再度お試しください。'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
     # --- Extensions Init ---
     db.init_app(app)
     migrate.init_app(app, db)
@@ -115,6 +174,7 @@ def create_app():
         resources={r"/api/*": {"origins": ["http://localhost:3000", "http://127.0.0.1:3000"]}},
         supports_credentials=True,
         allow_headers=["Content-Type", "Authorization"],
+        expose_headers=["X-Next-Cursor"],
         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     )
 
@@ -148,11 +208,11 @@ def create_app():
             return
         
         try:
-            from .models import Festivals, User, UserFavorite, EditLog, Review, InformationSubmission, Passkey, SharedFavorite, SiteSettings
+            from .models import Festivals, User, UserFavorite, EditLog, Review, InformationSubmission, Passkey, SharedFavorite, SiteSettings, Tombstone, OutboxEmail
             sqlite_engine = create_engine(sqlite_url)
             
             # 同期するモデルのリスト
-            models = [Festivals, User, UserFavorite, EditLog, Review, InformationSubmission, Passkey, SharedFavorite, SiteSettings]
+            models = [Festivals, User, UserFavorite, EditLog, Review, InformationSubmission, Passkey, SharedFavorite, SiteSettings, Tombstone, OutboxEmail]
 
             # スキーマの自動修復（不足カラムの追加）
             print("SQLiteのスキーマを確認中...")
@@ -188,6 +248,96 @@ def create_app():
         except Exception as e:
             print(f"同期失敗: {e}")
 
+    # --- カスタムコマンド: flask repair-favorite-counts ---
+    @app.cli.command("repair-favorite-counts")
+    def repair_favorite_counts():
+        """festivals.favorite_count を user_favorites の件数から再計算する"""
+        from sqlalchemy import func
+        from .models import Festivals, UserFavorite
+        from . import cache
+
+        actual = dict(
+            db.session.query(UserFavorite.festival_id, func.count(UserFavorite.id))
+            .group_by(UserFavorite.festival_id).all()
+        )
+        fixed = 0
+        for festival in Festivals.query.all():
+            count = actual.get(festival.id, 0)
+            if festival.favorite_count != count:
+                print(f"修正: {festival.id} {festival.name}: {festival.favorite_count} -> {count}")
+                festival.favorite_count = count
+                fixed += 1
+        db.session.commit()
+        cache.bump_version(cache.FAVORITES)
+        print(f"{fixed}件のお気に入り数を修正しました。")
+
+    # --- カスタムコマンド: flask repair-rating-stats ---
+    @app.cli.command("repair-rating-stats")
+    def repair_rating_stats():
+        """festivals のレビュー評価集計を reviews から再計算する"""
+        from sqlalchemy import func
+        from .models import Festivals, Review, RATING_VALUES
+        from . import cache
+
+        actual = {}
+        rows = db.session.query(Review.festival_id, Review.rating, func.count(Review.id)).group_by(Review.festival_id, Review.rating)
+        for festival_id, rating, count in rows:
+            if rating in RATING_VALUES:
+                actual.setdefault(festival_id, {})[rating] = count
+
+        fixed = 0
+        for festival in Festivals.query.all():
+            histogram = actual.get(festival.id, {})
+            expected = {f"rating_{r}": histogram.get(r, 0) for r in RATING_VALUES}
+            expected["rating_count"] = sum(histogram.values())
+            expected["rating_sum"] = sum(r * c for r, c in histogram.items())
+            if any(getattr(festival, k) != v for k, v in expected.items()):
+                print(f"修正: {festival.id} {festival.name}")
+                for k, v in expected.items():
+                    setattr(festival, k, v)
+                fixed += 1
+        db.session.commit()
+        cache.bump_version(cache.REVIEWS)
+        print(f"{fixed}件の評価集計を修正しました。")
+
+    # --- カスタムコマンド: flask reset-cache ---
+    @app.cli.command("reset-cache")
+    def reset_cache():
+        """DBを直接編集した後などに、全ワーカーのキャッシュとETagを無効化する"""
+        from . import cache
+        cache.bump_version(*cache.ALL_DOMAINS)
+        print("キャッシュのバージョンを更新しました。")
+
+    # --- カスタムコマンド: flask send-outbox ---
+    @app.cli.command("send-outbox")
+    def send_outbox():
+        """送信待ちのメールをその場で送る（送信スレッドを動かしていない環境や確認用）"""
+        from .outbox import flush_outbox
+        sent = flush_outbox()
+        print(f"{sent}件のメールを送信しました。")
+
+    # --- カスタムコマンド: flask gc-uploads ---
+    @app.cli.command("gc-uploads")
+    @click.option("--dry-run", is_flag=True, help="削除せずに対象を表示する")
+    @click.option("--min-age", type=int, default=None, help="最終更新からこの秒数以内のファイルは残す（既定 UPLOAD_GC_MIN_AGE）")
+    def gc_uploads(dry_run, min_age):
+        """アップロードの保存先のうち、どの写真からも参照されていないファイルを削除する"""
+        from .upload_gc import collect_orphans
+        from .uploads import format_size
+
+        label = "削除対象" if dry_run else "削除"
+        stats = collect_orphans(
+            dry_run=dry_run, min_age=min_age,
+            on_orphan=lambda name, size: print(f"{label}: {name} ({size} bytes)"),
+        )
+        if stats['purged_blobs']:
+            print(f"参照数が0の実体を{stats['purged_blobs']}件削除しました。")
+        verb = "削除できます" if dry_run else "削除しました"
+        print(
+            f"{stats['scanned']}件中{stats['orphaned']}件のファイル（{format_size(stats['reclaimed_bytes'])}、"
+            f"{stats['reclaimed_bytes']} bytes）を{verb}。更新から間もない{stats['recent']}件は確認していません。"
+        )
+
     # --- DB Initialization ---
     with app.app_context():
         # 現在のメインDB（MySQL or SQLite）のテーブルを作成
@@ -199,4 +349,19 @@ def create_app():
             sqlite_engine = create_engine(sqlite_url)
             db.metadata.create_all(sqlite_engine)
 
+        # 一覧スナップショットや検索・入力補完インデックスをワーカー起動時に構築しておく
+        if os.getenv("WARM_CACHES", "False") == "True":
+            from . import cache
+            cache.warm_all()
+
+        # 前回の起動中に送れなかったメールや他ワーカーが積んだ再送分を拾うため、送信スレッドを起動しておく
+        if app.config["OUTBOX_SENDER"]:
+            from .outbox import outbox_sender
+            outbox_sender.start(app)
+
+        # 参照されないアップロードを定期的に回収する（全ワーカーのうち1つが UPLOAD_GC_INTERVAL ごとに実行）
+        if app.config["UPLOAD_GC_INTERVAL"] > 0:
+            from .upload_gc import upload_collector
+            upload_collector.start(app)
+
     return app
\ No newline at end of file
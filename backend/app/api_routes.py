@@ -1,10 +1,19 @@
-from flask import Blueprint, request, jsonify, current_app, g, session, send_from_directory, make_response
-from .models import Festivals, User, UserFavorite, EditLog, Review, InformationSubmission, Passkey, FestivalPhoto, SharedFavorite, SiteSettings
+from flask import Blueprint, request, jsonify, current_app, g, session, make_response
+from .models import Festivals, User, UserFavorite, EditLog, Review, InformationSubmission, Passkey, FestivalPhoto, FestivalPhotoVariant, SharedFavorite, SiteSettings
+from .passwords import PasswordPoolBusy, password_pool
+from .models import Tombstone, adjust_favorite_counts, adjust_rating_stats, touch_festival, RATING_VALUES
 from datetime import datetime, timedelta, timezone
 from . import db, mail, limiter
+from . import cache, images, uploads
+from .geo import festival_geo_index, festival_cluster_index
+from .search import (
+    festival_search_index, festival_search_fields, festival_summary,
+    festival_suggest_index, festival_suggest_keys, festival_rank, normalize,
+)
 from .utils import calculate_concrete_date # 日付計算ユーティリティをインポート
 import jwt as pyjwt
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import base64
 import webauthn
@@ -13,13 +22,37 @@ import os
 import uuid
 from werkzeug.utils import secure_filename
 import re
+import zlib
 from urllib.parse import urlparse
-from sqlalchemy import func
+from sqlalchemy import and_, func, or_
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
 
 # 'api'という名前でBlueprintを作成
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 # --- 認証デコレータ ---
+# 認証済みユーザーのキャッシュ。ユーザー情報を更新するAPIはコミット後に USERS のバージョンを上げて無効化する
+# （バージョンはプロセス内のスナップショットで確認するため、キャッシュ済みなら DB に問い合わせない。
+#   他のワーカー・サーバーでの更新は DATA_VERSION_TTL 以内に反映される）
+user_cache = cache.LRUCache(
+    'user_cache', (cache.USERS,),
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 1024)), ttl=float(os.getenv('USER_CACHE_TTL', 60)),
+)
+
+def load_user_row(user_id):
+    """users の1行を列名の辞書で返す（キャッシュにはセッションに依存しない値だけを保存する）"""
+    user = User.query.filter_by(id=user_id).first()
+    if not user:
+        return None
+    return {attr.key: getattr(user, attr.key) for attr in sa_inspect(User).column_attrs}
+
+def user_from_row(row):
+    """キャッシュした辞書から、現在のセッションに属する User を SELECT なしで復元する"""
+    user = User(**row)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -32,10 +65,10 @@ def token_required(f):
 
         try:
             data = pyjwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['user_id']).first()
-            if not current_user:
+            row = user_cache.get(data['user_id'], lambda: load_user_row(data['user_id']))
+            if not row:
                 return jsonify({'error': 'ユーザーが見つかりません。'}), 401
-            g.current_user = current_user
+            g.current_user = user_from_row(row)
         except pyjwt.ExpiredSignatureError:
             return jsonify({'error': 'トークンの有効期限が切れています。再ログインしてください。'}), 401
         except pyjwt.InvalidTokenError:
@@ -71,6 +104,43 @@ def get_rp_id():
         return 'localhost'
     return host
 
+def not_modified(etag):
+    """
+    If-None-Match がETagと一致すれば 304 レスポンスを返す（一致しなければ None）
+    DBに触れる前に呼び出し、変更がない再訪問をヘッダー比較だけで返す。
+    """
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+def with_etag(response, etag):
+    """レスポンスにETagを付与し、次回以降は再検証させる"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def festival_saved(festival, *domains):
+    """
+    お祭りの追加・更新をコミットした後に呼び、キャッシュのバージョンを進めて
+    検索インデックスへ差分を反映する
+    """
+    bumped = cache.bump_version(cache.FESTIVALS, *domains)
+    festival_search_index.apply_update(
+        bumped, lambda index: index.add(festival.id, festival_search_fields(festival), festival_summary(festival))
+    )
+    festival_suggest_index.apply_update(
+        bumped, lambda trie: trie.add(festival.id, festival_suggest_keys(festival), festival_rank(festival), festival_summary(festival))
+    )
+
+def festival_deleted(festival_id, *domains):
+    """お祭りの削除をコミットした後に呼ぶ"""
+    bumped = cache.bump_version(cache.FESTIVALS, *domains)
+    festival_search_index.apply_update(bumped, lambda index: index.remove(festival_id))
+    festival_suggest_index.apply_update(bumped, lambda trie: trie.remove(festival_id))
+
 # --- Debug API ---
 
 # GET /api/test : バックエンドサーバーとの接続テスト用
@@ -80,50 +150,286 @@ def test_connection():
 
 # --- Festival API ---
 
+# 一覧APIで返すことができる festivals テーブルのカラム
+FESTIVAL_LIST_COLUMNS = {
+    'id': Festivals.id,
+    'name': Festivals.name,
+    'name_kana': Festivals.name_kana,
+    'date': Festivals.date,
+    'location': Festivals.location,
+    'latitude': Festivals.latitude,
+    'longitude': Festivals.longitude,
+    'attendance': Festivals.attendance,
+    'description': Festivals.description,
+    'access': Festivals.access,
+    'favorites': Festivals.favorite_count,
+    'rating_count': Festivals.rating_count,
+    'rating_average': func.round(
+        db.case((Festivals.rating_count > 0, Festivals.rating_sum * 1.0 / Festivals.rating_count), else_=None), 2
+    ),
+}
+# 別テーブルから取得するフィールド
+FESTIVAL_LIST_RELATED_FIELDS = ('photos',)
+FESTIVAL_LIST_FIELDS = set(FESTIVAL_LIST_COLUMNS) | set(FESTIVAL_LIST_RELATED_FIELDS)
+MAX_FESTIVAL_PAGE_SIZE = 500
+
+def build_festival_list(fields=None, after_id=None, limit=None, date_from=None, date_to=None, updated_since=None):
+    """
+    お祭り一覧（写真・お気に入り数を含む）を組み立てる
+    :param fields: 返すフィールド名の集合（None なら全て。id は常に含む）
+    :param after_id: このIDより大きいお祭りのみ返す（ページングのカーソル）
+    :param limit: 最大件数
+    :param date_from: この日以降に開催されるお祭りのみ返す（festivals.date のインデックスを使用）
+    :param date_to: この日以前に開催されるお祭りのみ返す
+    :param updated_since: この日時より後に更新されたお祭りのみ返す（差分同期用）
+    """
+    fields = FESTIVAL_LIST_FIELDS if fields is None else fields | {'id'}
+    paged = any(v is not None for v in (after_id, limit, date_from, date_to, updated_since))
+
+    # 必要なカラムのみを明示的に取得する
+    columns = [column.label(name) for name, column in FESTIVAL_LIST_COLUMNS.items() if name in fields]
+    festivals_query = db.session.query(*columns).order_by(Festivals.id)
+    if after_id is not None:
+        festivals_query = festivals_query.filter(Festivals.id > after_id)
+    if date_from is not None:
+        festivals_query = festivals_query.filter(Festivals.date >= date_from)
+    if date_to is not None:
+        festivals_query = festivals_query.filter(Festivals.date <= date_to)
+    if updated_since is not None:
+        festivals_query = festivals_query.filter(Festivals.updated_at > updated_since)
+    if limit is not None:
+        festivals_query = festivals_query.limit(limit)
+    festivals = festivals_query.all()
+    festival_ids = [festival.id for festival in festivals]
+
+    # 写真データを一括取得してマッピング（要求された場合のみ）
+    photos_map = {}
+    if 'photos' in fields:
+        # 派生画像は写真全体で1回のクエリにまとめて読み込む
+        photos_query = FestivalPhoto.query.options(db.selectinload(FestivalPhoto.variants))
+        if paged:
+            photos_query = photos_query.filter(FestivalPhoto.festival_id.in_(festival_ids))
+        for p in photos_query.all():
+            if p.festival_id not in photos_map:
+                photos_map[p.festival_id] = []
+            photos_map[p.festival_id].append(p.to_dict())
+
+    festival_list = []
+    for festival in festivals:
+        festival_data = festival._asdict()
+        if 'date' in festival_data:
+            festival_data['date'] = festival.date.strftime('%Y-%m-%d') if festival.date else None
+        if 'photos' in fields:
+            festival_data['photos'] = photos_map.get(festival.id, [])
+
+        festival_list.append(festival_data)
+
+    return festival_list
+
+# お祭り一覧のシリアライズ済みスナップショット（お祭り・写真・お気に入り・レビューの更新時のみ再構築）
+festival_snapshot = cache.JSONSnapshot(
+    'festival_list', (cache.FESTIVALS, cache.PHOTOS, cache.FAVORITES, cache.REVIEWS), build_festival_list
+)
+
 # GET /api/festivals : 全てのお祭りを取得
+#   ?fields=id,name,latitude,longitude : 返すフィールドを指定
+#   ?limit=100&cursor=<前ページ最後のID> : ページング（次ページのカーソルは X-Next-Cursor ヘッダー）
+#   ?from=2026-08-01&to=2026-08-15 : 開催日で絞り込み / ?upcoming=7 : 今日から7日以内に開催
 @api_bp.route('/festivals', methods=['GET'])
 def get_festivals():
-    # 必要なカラムのみを明示的に取得する
-    festivals_query = db.session.query(
-        Festivals.id,
-        Festivals.name,
-        Festivals.date,
-        Festivals.location,
-        Festivals.latitude,
-        Festivals.longitude,
-        Festivals.attendance,
-        Festivals.description, # descriptionを追加
-        Festivals.access, # accessを追加
-    ).all()
+    if not any(key in request.args for key in ('fields', 'limit', 'cursor', 'from', 'to', 'upcoming')):
+        cached = not_modified(cache.make_etag('festivals', *festival_snapshot.current_version()))
+        if cached:
+            return cached
+
+        version, body = festival_snapshot.get()
+        response = current_app.response_class(body, mimetype='application/json')
+        return with_etag(response, cache.make_etag('festivals', *version))
+
+    fields = None
+    if request.args.get('fields'):
+        fields = {name.strip() for name in request.args['fields'].split(',') if name.strip()}
+        unknown = fields - FESTIVAL_LIST_FIELDS
+        if unknown:
+            return jsonify({'error': f'不明なフィールドです: {", ".join(sorted(unknown))}'}), 400
 
-    # 写真データを一括取得してマッピング
-    photos = FestivalPhoto.query.all()
-    photos_map = {}
-    for p in photos:
-        if p.festival_id not in photos_map:
-            photos_map[p.festival_id] = []
-        photos_map[p.festival_id].append(p.to_dict())
+    try:
+        limit = request.args.get('limit', type=int) if 'limit' in request.args else None
+        after_id = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'limit と cursor は整数で指定してください'}), 400
+    if 'limit' in request.args and (limit is None or not 1 <= limit <= MAX_FESTIVAL_PAGE_SIZE):
+        return jsonify({'error': f'limit は 1〜{MAX_FESTIVAL_PAGE_SIZE} の整数で指定してください'}), 400
 
-    # お気に入り数を一括取得
-    fav_counts = db.session.query(
-        UserFavorite.festival_id, func.count(UserFavorite.id)
-    ).group_by(UserFavorite.festival_id).all()
-    fav_map = {fid: count for fid, count in fav_counts}
+    try:
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from と to は YYYY-MM-DD 形式で指定してください'}), 400
+    if 'upcoming' in request.args:
+        days = request.args.get('upcoming', type=int)
+        if days is None or days < 0:
+            return jsonify({'error': 'upcoming は 0 以上の日数で指定してください'}), 400
+        today = datetime.now().date()
+        date_from = max(date_from, today) if date_from else today
+        date_to = min(date_to, today + timedelta(days=days)) if date_to else today + timedelta(days=days)
+
+    # upcoming は日付によって結果が変わるため絞り込み範囲もETagに含める
+    etag = cache.make_etag('festivals', *festival_snapshot.current_version(),
+                           zlib.crc32(request.query_string + f'{date_from}{date_to}'.encode()))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # 1件多く取得して次ページの有無を判定する
+    festival_list = build_festival_list(fields, after_id, limit + 1 if limit else None, date_from, date_to)
+    next_cursor = None
+    if limit and len(festival_list) > limit:
+        festival_list = festival_list[:limit]
+        next_cursor = festival_list[-1]['id']
+
+    response = with_etag(jsonify(festival_list), etag)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
 
-    festival_list = []
-    for festival in festivals_query:
-        festival_data = {
-            'id': festival.id, 'name': festival.name, 'date': festival.date.strftime('%Y-%m-%d') if festival.date else None,
-            'location': festival.location, 'latitude': festival.latitude, 'longitude': festival.longitude, 'attendance': festival.attendance,
-            'description': festival.description, # レスポンスに追加
-            'access': festival.access, # レスポンスに追加
-            'photos': photos_map.get(festival.id, []), # 写真データを追加
-            'favorites': fav_map.get(festival.id, 0) # お気に入り数を追加
-        }
+# --- 差分同期 ---
+# バージョンはサーバー時刻（UTCのミリ秒）。コミット順と更新日時の前後が入れ替わっても取りこぼさないよう、
+# 前回バージョンより CHANGES_OVERLAP だけ遡って返す（クライアントはIDで上書きするため重複は問題にならない）
+CHANGES_OVERLAP = timedelta(seconds=10)
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+def datetime_to_version(dt):
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def version_to_datetime(version):
+    return datetime.fromtimestamp(version / 1000, timezone.utc).replace(tzinfo=None)
+
+def add_tombstone(kind, record_id, festival_id=None):
+    """削除の記録を追加し、保持期間を過ぎた古い記録を消す（呼び出し元のトランザクション内で実行）"""
+    db.session.add(Tombstone(kind=kind, record_id=record_id, festival_id=festival_id))
+    Tombstone.query.filter(Tombstone.deleted_at < datetime.utcnow() - TOMBSTONE_RETENTION).delete()
+
+# GET /api/festivals/changes?since=<version> : 前回の同期以降に変更・削除されたお祭りを取得
+#   since=0 または保持期間より古い場合は全件を返し full=true とする。
+#   クライアントは deleted_* を先に適用してから festivals をIDで上書きし、version を次回の since に使う。
+@api_bp.route('/festivals/changes', methods=['GET'])
+def get_festival_changes():
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return jsonify({'error': 'since を指定してください'}), 400
+
+    now = datetime.utcnow()
+    # since はこのAPIが返した version。日時に変換できない値や未来の値は受け付けない
+    try:
+        since_at = version_to_datetime(since)
+    except (OverflowError, OSError, ValueError):
+        since_at = None
+    if since_at is None or since_at > now:
+        return jsonify({'error': 'since が正しくありません'}), 400
+    full = since == 0 or since_at < now - TOMBSTONE_RETENTION
+
+    if full:
+        festivals = build_festival_list()
+        deleted = []
+    else:
+        threshold = since_at - CHANGES_OVERLAP
+        festivals = build_festival_list(updated_since=threshold)
+        deleted = Tombstone.query.filter(Tombstone.deleted_at > threshold).all()
 
-        festival_list.append(festival_data)
+    return jsonify({
+        'version': datetime_to_version(now),
+        'full': full,
+        'festivals': festivals,
+        'deleted_festivals': sorted({t.record_id for t in deleted if t.kind == 'festival'}),
+        'deleted_photos': sorted({t.record_id for t in deleted if t.kind == 'photo'}),
+    }), 200
 
-    return jsonify(festival_list)
+# GET /api/festivals/near?lat=&lng=&radius=&k= : 指定地点から近い順にお祭りを取得（radius は km）
+@api_bp.route('/festivals/near', methods=['GET'])
+def get_nearby_festivals():
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius = request.args.get('radius', type=float)
+    k = request.args.get('k', default=10, type=int)
+
+    if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return jsonify({'error': 'lat と lng を正しく指定してください'}), 400
+    if radius is not None and radius <= 0:
+        return jsonify({'error': 'radius は正の数で指定してください'}), 400
+    if not 1 <= k <= 100:
+        return jsonify({'error': 'k は 1〜100 の整数で指定してください'}), 400
+
+    etag = cache.make_etag('near', *festival_geo_index.current_version(), zlib.crc32(request.query_string))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    _, (index, summaries) = festival_geo_index.get()
+    results = [
+        dict(summaries[point[0]], distance_km=round(distance, 3))
+        for distance, point in index.nearest(lat, lng, k=k, radius_km=radius)
+    ]
+    return with_etag(jsonify(results), etag)
+
+# GET /api/festivals/clusters?bbox=西,南,東,北&zoom= : 表示範囲の地図マーカーをクラスタにまとめて取得
+@api_bp.route('/festivals/clusters', methods=['GET'])
+def get_festival_clusters():
+    zoom = request.args.get('zoom', type=int)
+    try:
+        west, south, east, north = (float(v) for v in request.args.get('bbox', '').split(','))
+    except ValueError:
+        return jsonify({'error': 'bbox は 西,南,東,北 の経度緯度で指定してください'}), 400
+
+    if zoom is None or zoom < 0:
+        return jsonify({'error': 'zoom を指定してください'}), 400
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        return jsonify({'error': 'bbox の範囲が不正です'}), 400
+
+    etag = cache.make_etag('clusters', *festival_cluster_index.current_version(), zlib.crc32(request.query_string))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    _, pyramid = festival_cluster_index.get()
+    return with_etag(jsonify(pyramid.query(west, south, east, north, zoom)), etag)
+
+# GET /api/festivals/search?q=&limit= : お祭りの名前・場所・説明文から検索
+@api_bp.route('/festivals/search', methods=['GET'])
+def search_festivals():
+    q = request.args.get('q', '').strip()
+    limit = request.args.get('limit', default=20, type=int)
+    if not q:
+        return jsonify({'error': '検索キーワードを入力してください'}), 400
+    if not 1 <= limit <= 100:
+        return jsonify({'error': 'limit は 1〜100 の整数で指定してください'}), 400
+
+    etag = cache.make_etag('search', *festival_search_index.current_version(), zlib.crc32(request.query_string))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    _, index = festival_search_index.get()
+    results = [dict(summary, score=round(score, 3)) for score, summary in index.search(q, limit)]
+    return with_etag(jsonify(results), etag)
+
+# GET /api/festivals/suggest?prefix=&limit= : お祭り名・読み仮名の前方一致で入力候補を取得
+@api_bp.route('/festivals/suggest', methods=['GET'])
+def suggest_festivals():
+    prefix = normalize(request.args.get('prefix', ''))
+    limit = request.args.get('limit', default=10, type=int)
+    if not prefix:
+        return jsonify([]), 200
+    if not 1 <= limit <= 10:
+        return jsonify({'error': 'limit は 1〜10 の整数で指定してください'}), 400
+
+    etag = cache.make_etag('suggest', *festival_suggest_index.current_version(), zlib.crc32(request.query_string))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    _, trie = festival_suggest_index.get()
+    return with_etag(jsonify(trie.suggest(prefix, limit)), etag)
 
 # POST /api/festivals : 新しいお祭りを追加
 @api_bp.route('/festivals', methods=['POST'])
@@ -149,6 +455,7 @@ def add_festival():
             except (ValueError, TypeError):
                 pass
 
+        existing_festival.name_kana = data.get('name_kana', existing_festival.name_kana)
         existing_festival.description = data.get('description', existing_festival.description)
         existing_festival.access = data.get('access', existing_festival.access)
         existing_festival.attendance = data.get('attendance', existing_festival.attendance)
@@ -157,6 +464,7 @@ def add_festival():
         existing_festival.location = data.get('location', existing_festival.location)
         
         db.session.commit()
+        festival_saved(existing_festival)
         return jsonify(existing_festival.to_dict()), 200
 
     fes_date = None
@@ -169,6 +477,7 @@ def add_festival():
 
     new_festival = Festivals(
         name=data['name'],
+        name_kana=data.get('name_kana'),
         date=fes_date,
         location=data['location'],
         description=data.get('description'),
@@ -179,6 +488,7 @@ def add_festival():
     )
     db.session.add(new_festival)
     db.session.commit()
+    festival_saved(new_festival)
     return jsonify(new_festival.to_dict()), 201
 
 # PUT, DELETE /api/festivals/<int:festival_id>
@@ -200,6 +510,7 @@ def manage_festival(festival_id):
 
         # 各フィールドを更新
         festival.name = data.get('name', festival.name)
+        festival.name_kana = data.get('name_kana', festival.name_kana)
         festival.location = data.get('location', festival.location)
         festival.description = data.get('description', festival.description)
         festival.access = data.get('access', festival.access)
@@ -214,21 +525,36 @@ def manage_festival(festival_id):
                 pass # 日付形式が不正な場合は無視
         
         db.session.commit()
+        festival_saved(festival)
         return jsonify(festival.to_dict()), 200
 
     elif request.method == 'DELETE':
         # 関連データの削除
         UserFavorite.query.filter_by(festival_id=festival_id).delete()
         Review.query.filter_by(festival_id=festival_id).delete()
+        released = release_photo_files(
+            FestivalPhoto.query.options(db.selectinload(FestivalPhoto.variants)).filter_by(festival_id=festival_id)
+        )
+        FestivalPhotoVariant.query.filter(FestivalPhotoVariant.photo_id.in_(
+            db.session.query(FestivalPhoto.id).filter_by(festival_id=festival_id)
+        )).delete(synchronize_session=False)
         FestivalPhoto.query.filter_by(festival_id=festival_id).delete()
+        add_tombstone('festival', festival_id)
         
         db.session.delete(festival)
         db.session.commit()
+        festival_deleted(festival_id, cache.PHOTOS, cache.FAVORITES, cache.REVIEWS)
+        uploads.purge_blobs(released)
         return jsonify({'message': 'Festival deleted successfully'}), 200
 
 # GET /api/festivals/<int:festival_id>/ics : iCal形式のファイルを配信（webcal用）
 @api_bp.route('/festivals/<int:festival_id>/ics', methods=['GET'])
 def get_festival_ics(festival_id):
+    etag = cache.make_etag('ics', festival_id, cache.get_version(cache.FESTIVALS))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
     festival = Festivals.query.get(festival_id)
     if not festival:
         return jsonify({'error': 'Not found'}), 404
@@ -239,7 +565,8 @@ def get_festival_ics(festival_id):
     date_str = festival.date.strftime('%Y%m%d')
     next_day = festival.date + timedelta(days=1)
     next_day_str = next_day.strftime('%Y%m%d')
-    now_str = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    # DTSTAMP は最終更新時刻とし、同じETagに対して常に同じ内容を返す
+    now_str = datetime.fromtimestamp(cache.get_version_mtime(cache.FESTIVALS), timezone.utc).strftime('%Y%m%dT%H%M%SZ')
     
     ics_content = f"""BEGIN:VCALENDAR
 VERSION:2.0
@@ -263,7 +590,7 @@ END:VCALENDAR"""
     response = make_response(ics_content)
     response.headers["Content-Type"] = "text/calendar; charset=utf-8"
     response.headers["Content-Disposition"] = f"attachment; filename=festival_{festival.id}.ics"
-    return response
+    return with_etag(response, etag)
 
 # POST /api/festivals/bulk-update-year : 全てのお祭りの年を一括更新
 @api_bp.route('/festivals/bulk-update-year', methods=['POST'])
@@ -291,8 +618,54 @@ def bulk_update_year():
             count += 1
 
     db.session.commit()
+    cache.bump_version(cache.FESTIVALS)
     return jsonify({'message': f'{count}件のお祭りを{target_year}年に更新しました'}), 200
 
+def shared_variants(content_hash):
+    """同じ画像の既存の写真の縮小版（ファイルは共有されているため情報だけ流用する）。なければ None"""
+    same = (FestivalPhoto.query.options(db.selectinload(FestivalPhoto.variants))
+            .filter(FestivalPhoto.content_hash == content_hash, FestivalPhoto.variants.any())
+            .first())
+    if same is None:
+        return None
+    return [{
+        'size': v.size, 'format': v.format, 'width': v.width, 'height': v.height, 'image_url': v.image_url,
+    } for v in same.variants]
+
+def make_variants(directory, content_hash, filename):
+    """
+    一覧・地図用の縮小版（WebP / JPEG）を '<hash>_<size>.<ext>' として作成する
+    （DB にも current_app にも触れないため、スレッドプールからも呼べる）
+    """
+    return [{
+        'size': v['size'], 'format': v['format'], 'width': v['width'], 'height': v['height'],
+        'image_url': uploads.upload_url(v['filename']),
+    } for v in images.generate_variants(os.path.join(directory, filename), directory, content_hash)]
+
+def photo_variants(content_hash, filename, created):
+    """写真の縮小版（FestivalPhotoVariant の列の dict のリスト）。同じ画像の写真が既にあればその情報を流用する"""
+    variants = None if created else shared_variants(content_hash)
+    if variants is None:
+        variants = make_variants(uploads.get_storage().staging_dir(), content_hash, filename)
+    return variants
+
+def release_photo_files(photos):
+    """
+    写真が参照するファイルを手放す（commit 後に uploads.purge_blobs(戻り値) を呼ぶこと）
+    内容のハッシュ名で保存する前の写真は共有されていないため、ファイルをそのまま削除する
+    :return: 参照数を減らした content_hash のリスト
+    """
+    released = []
+    for photo in photos:
+        if photo.content_hash:
+            uploads.release_blob(photo.content_hash)
+            released.append(photo.content_hash)
+        else:
+            uploads.remove_files(
+                [url for url in [photo.image_url] + [v.image_url for v in photo.variants] if url]
+            )
+    return released
+
 # POST /api/festivals/<festival_id>/photos : お祭りの写真をアップロード
 @api_bp.route('/festivals/<int:festival_id>/photos', methods=['POST'])
 @token_required
@@ -301,37 +674,105 @@ def upload_festival_photo(festival_id):
     if not g.current_user.is_administrator:
         return jsonify({'error': '権限がありません'}), 403
 
-    if 'photo' not in request.files:
+    # 本文はストリーミングで受信する（request.files は使わない。サイズ・形式の上限は app/uploads.py）
+    try:
+        received = uploads.receive_files('photo')
+    except uploads.UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    if not received:
         return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['photo']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-        
-    if file:
-        # ファイル名の安全化とユニーク化
-        ext = os.path.splitext(file.filename)[1].lower()
-        if not ext:
-            ext = '.jpg'
-        
-        unique_filename = f"{festival_id}_{uuid.uuid4().hex}{ext}"
-        
-        # 保存先ディレクトリ（app/static/uploads）
-        upload_dir = os.path.join(current_app.root_path, 'static', 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        file.save(os.path.join(upload_dir, unique_filename))
-        
-        # DBに保存するURLパス
-        image_url = f"/api/uploads/{unique_filename}"
-        
-        new_photo = FestivalPhoto(festival_id=festival_id, image_url=image_url)
-        db.session.add(new_photo)
-        db.session.commit()
-        
-        return jsonify(new_photo.to_dict()), 201
 
-    return jsonify({'error': 'Upload failed'}), 500
+    # 内容のハッシュ名で保存する（同じ画像が既にあればファイルを共有し、参照数だけ増やす）
+    content_hash, filename, created = uploads.store_upload(received[0])
+
+    new_photo = FestivalPhoto(
+        festival_id=festival_id, image_url=uploads.upload_url(filename), content_hash=content_hash,
+    )
+    variants = photo_variants(content_hash, filename, created)
+    for variant in variants:
+        new_photo.variants.append(FestivalPhotoVariant(**variant))
+    # 行より先にファイルを保存先に置く（commit に失敗して残ったファイルは flask gc-uploads で回収する）
+    uploads.publish_files([filename] + [variant['image_url'] for variant in variants])
+    db.session.add(new_photo)
+    touch_festival(festival_id)
+    db.session.commit()
+    cache.bump_version(cache.PHOTOS)
+
+    return jsonify(new_photo.to_dict()), 201
+
+MAX_PHOTO_BATCH_FILES = 50
+
+# POST /api/festivals/<festival_id>/photos/batch : 複数の写真をまとめてアップロード（フィールド名 photos）
+#   ファイルごとの結果を受信順に results で返す。保存できた写真は1回の commit でまとめて登録する
+@api_bp.route('/festivals/<int:festival_id>/photos/batch', methods=['POST'])
+@token_required
+def upload_festival_photos_batch(festival_id):
+    if not g.current_user.is_administrator:
+        return jsonify({'error': '権限がありません'}), 403
+    if db.session.get(Festivals, festival_id) is None:
+        return jsonify({'error': 'Festival not found'}), 404
+
+    # 形式・サイズが上限外のファイルは、そのファイルだけエラーにして残りを受信する
+    try:
+        received = uploads.receive_files(
+            'photos', max_files=MAX_PHOTO_BATCH_FILES,
+            max_request_size=current_app.config.get('PHOTO_BATCH_MAX_SIZE'), skip_invalid=True,
+        )
+    except uploads.UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    if not received:
+        return jsonify({'error': 'No file part'}), 400
+
+    stored = []
+    for index, item in enumerate(received):
+        if item.error is None:
+            stored.append((index,) + uploads.store_upload(item))
+
+    # 縮小版の作成（画像のデコード・縮小・エンコード）と保存先への公開は重いため、画像ごとにスレッドプールで並行に行う。
+    # 同じバッチ内の同じ画像は1回だけ。既存の写真と同じ画像なら縮小版は作らずに流用する
+    variants = {}
+    to_prepare = {}
+    for _, content_hash, filename, created in stored:
+        if content_hash in to_prepare:
+            continue
+        shared = None if created else shared_variants(content_hash)
+        to_prepare[content_hash] = (filename, shared)
+    if to_prepare:
+        storage = uploads.get_storage()
+        directory = storage.staging_dir()
+
+        def prepare(content_hash, filename, shared):
+            result = shared if shared is not None else make_variants(directory, content_hash, filename)
+            uploads.publish_files([filename] + [variant['image_url'] for variant in result], storage)
+            return result
+
+        workers = min(current_app.config.get('PHOTO_BATCH_WORKERS', 4), len(to_prepare))
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='photo-variants') as pool:
+            prepared = pool.map(lambda item: prepare(item[0], *item[1]), to_prepare.items())
+            variants.update(zip(to_prepare, prepared))
+
+    photos = []
+    for index, content_hash, filename, _ in stored:
+        photo = FestivalPhoto(festival_id=festival_id, image_url=uploads.upload_url(filename), content_hash=content_hash)
+        for variant in variants[content_hash]:
+            photo.variants.append(FestivalPhotoVariant(**variant))
+        db.session.add(photo)
+        photos.append((index, photo))
+    if photos:
+        touch_festival(festival_id)
+    db.session.commit()
+    if photos:
+        cache.bump_version(cache.PHOTOS)
+
+    results = [
+        {'filename': item.filename, 'status': item.error.status, 'error': str(item.error)} if item.error else None
+        for item in received
+    ]
+    for index, photo in photos:
+        results[index] = {'filename': received[index].filename, 'status': 201, 'photo': photo.to_dict()}
+    if not photos:
+        return jsonify({'error': '写真を保存できませんでした', 'results': results}), 400
+    return jsonify({'results': results}), 201
 
 # DELETE /api/photos/<photo_id> : 写真を削除
 @api_bp.route('/photos/<int:photo_id>', methods=['DELETE'])
@@ -344,25 +785,130 @@ def delete_photo(photo_id):
     if not photo:
         return jsonify({'error': 'Photo not found'}), 404
 
-    # ファイルの実体削除
-    if photo.image_url:
-        filename = os.path.basename(photo.image_url)
-        file_path = os.path.join(current_app.root_path, 'static', 'uploads', filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    # ファイルの参照を外す（他の写真と共有していなければ縮小版を含めて削除する）
+    released = release_photo_files([photo])
 
+    add_tombstone('photo', photo.id, photo.festival_id)
+    touch_festival(photo.festival_id)
     db.session.delete(photo)
     db.session.commit()
+    cache.bump_version(cache.PHOTOS)
+    uploads.purge_blobs(released)
     
     return jsonify({'message': 'Photo deleted successfully'}), 200
 
 # --- Review API ---
 
-# GET /api/festivals/<festival_id>/reviews : 特定のお祭りのレビューを取得
+# limit を省略した場合も1ページずつ返し、レビューが増えても応答の大きさを一定にする
+DEFAULT_REVIEW_PAGE_SIZE = 20
+MAX_REVIEW_PAGE_SIZE = 100
+
+MAX_REVIEW_BATCH_FESTIVALS = 100
+
+def review_query():
+    """投稿者名をJOINで同時に読み込むレビューのクエリ（to_dict でレビューごとの users 問い合わせを発生させない）"""
+    return Review.query.options(db.joinedload(Review.user).load_only(User.username))
+
+def review_cursor(review):
+    return f"{review.created_at.isoformat()},{review.id}"
+
+def parse_review_cursor(value):
+    """'<created_at>,<id>' 形式のカーソルを (datetime, id) に変換する"""
+    created_at, _, review_id = value.rpartition(',')
+    return datetime.fromisoformat(created_at), int(review_id)
+
+# GET /api/festivals/<festival_id>/reviews : 特定のお祭りのレビューを取得（新しい順）
+#   ?limit=20&before=<created_at,id> : ページング（limit の既定は DEFAULT_REVIEW_PAGE_SIZE。次ページのカーソルは X-Next-Cursor ヘッダー）
 @api_bp.route('/festivals/<int:festival_id>/reviews', methods=['GET'])
 def get_reviews_for_festival(festival_id):
-    reviews = Review.query.filter_by(festival_id=festival_id).order_by(Review.created_at.desc()).all()
-    return jsonify([review.to_dict() for review in reviews]), 200
+    try:
+        limit = request.args.get('limit', type=int) if 'limit' in request.args else DEFAULT_REVIEW_PAGE_SIZE
+        before = parse_review_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'before は <created_at>,<id> 形式で指定してください'}), 400
+    if limit is None or not 1 <= limit <= MAX_REVIEW_PAGE_SIZE:
+        return jsonify({'error': f'limit は 1〜{MAX_REVIEW_PAGE_SIZE} の整数で指定してください'}), 400
+
+    # レビューには投稿者名が含まれるため、ユーザー情報の更新でもETagを変える
+    etag = cache.make_etag('reviews', festival_id, *cache.get_versions(cache.REVIEWS, cache.USERS),
+                           zlib.crc32(request.query_string))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # ix_reviews_festival_id_created_at を順にたどるため、件数が増えても1ページの取得コストは一定
+    reviews_query = review_query().filter_by(festival_id=festival_id)
+    if before is not None:
+        before_created_at, before_id = before
+        # created_at <= を併記してインデックスの範囲検索に使わせる（OR だけでは全件走査になる）
+        reviews_query = reviews_query.filter(Review.created_at <= before_created_at, or_(
+            Review.created_at < before_created_at,
+            and_(Review.created_at == before_created_at, Review.id < before_id),
+        ))
+    # 1件多く取得して次ページの有無を判定する
+    reviews = reviews_query.order_by(Review.created_at.desc(), Review.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = review_cursor(reviews[-1])
+
+    response = with_etag(jsonify([review.to_dict() for review in reviews]), etag)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+# GET /api/festivals/<festival_id>/reviews/summary : レビュー評価の件数・平均・分布を取得
+@api_bp.route('/festivals/<int:festival_id>/reviews/summary', methods=['GET'])
+def get_review_summary(festival_id):
+    etag = cache.make_etag('review-summary', festival_id, cache.get_version(cache.REVIEWS))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    festival = db.session.get(Festivals, festival_id)
+    if not festival:
+        return jsonify({'error': 'Festival not found'}), 404
+    return with_etag(jsonify(festival.rating_summary()), etag), 200
+
+# GET /api/reviews?festival_ids=1,2,3&limit=5 : 複数のお祭りのレビューをまとめて取得（各お祭り新しい順に最大 limit 件）
+@api_bp.route('/reviews', methods=['GET'])
+def get_reviews_for_festivals():
+    try:
+        festival_ids = sorted({int(v) for v in request.args.get('festival_ids', '').split(',') if v.strip()})
+    except ValueError:
+        return jsonify({'error': 'festival_ids はカンマ区切りの整数で指定してください'}), 400
+    if not 1 <= len(festival_ids) <= MAX_REVIEW_BATCH_FESTIVALS:
+        return jsonify({'error': f'festival_ids は 1〜{MAX_REVIEW_BATCH_FESTIVALS} 件で指定してください'}), 400
+    limit = request.args.get('limit', default=DEFAULT_REVIEW_PAGE_SIZE, type=int)
+    if limit is None or not 1 <= limit <= MAX_REVIEW_PAGE_SIZE:
+        return jsonify({'error': f'limit は 1〜{MAX_REVIEW_PAGE_SIZE} の整数で指定してください'}), 400
+
+    etag = cache.make_etag('reviews', *cache.get_versions(cache.REVIEWS, cache.USERS),
+                           zlib.crc32(request.query_string))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # お祭りごとの新しい順の順位をウィンドウ関数で付け、上位 limit 件を投稿者と合わせて1回のクエリで取得する
+    ranked = db.session.query(
+        Review.id.label('id'),
+        func.row_number().over(
+            partition_by=Review.festival_id, order_by=(Review.created_at.desc(), Review.id.desc())
+        ).label('position'),
+    ).filter(Review.festival_id.in_(festival_ids)).subquery()
+    reviews = (
+        review_query()
+        .join(ranked, ranked.c.id == Review.id)
+        .filter(ranked.c.position <= limit)
+        .order_by(Review.festival_id, Review.created_at.desc(), Review.id.desc())
+        .all()
+    )
+
+    result = {str(festival_id): [] for festival_id in festival_ids}
+    for review in reviews:
+        result[str(review.festival_id)].append(review.to_dict())
+    return with_etag(jsonify(result), etag), 200
 
 # POST /api/festivals/<festival_id>/reviews : 新しいレビューを投稿
 @api_bp.route('/festivals/<int:festival_id>/reviews', methods=['POST'])
@@ -372,14 +918,23 @@ def post_review(festival_id):
     if not data or 'rating' not in data or 'comment' not in data:
         return jsonify({'error': 'Rating and comment are required'}), 400
 
+    try:
+        rating = int(data['rating'])
+    except (TypeError, ValueError):
+        rating = None
+    if rating not in RATING_VALUES:
+        return jsonify({'error': 'Rating must be an integer from 1 to 5'}), 400
+
     new_review = Review(
         festival_id=festival_id,
         user_id=g.current_user.id,
-        rating=data['rating'],
+        rating=rating,
         comment=data['comment']
     )
     db.session.add(new_review)
+    adjust_rating_stats(festival_id, rating)
     db.session.commit()
+    cache.bump_version(cache.REVIEWS)
 
     return jsonify(new_review.to_dict()), 201
 
@@ -425,6 +980,8 @@ def register():
         new_user.set_password(password)
         db.session.add(new_user)
         db.session.commit()
+    except PasswordPoolBusy:
+        raise
     except Exception as e:
         db.session.rollback()
         print(f"Error during registration: {e}")
@@ -493,20 +1050,29 @@ def update_favorites():
     data = request.get_json()
     new_favorites = data.get('favorites', {})
 
-    # 既存のお気に入りをすべて削除
-    UserFavorite.query.filter_by(user_id=user_id).delete()
-
-    # 新しいお気に入りを追加
+    new_ids = set()
     for festival_id_str, is_favorite in new_favorites.items():
         if is_favorite:
             try:
-                festival_id = int(festival_id_str)
-                new_fav = UserFavorite(user_id=user_id, festival_id=festival_id)
-                db.session.add(new_fav)
+                new_ids.add(int(festival_id_str))
             except ValueError:
                 return jsonify({'error': f'Invalid festival_id: {festival_id_str}'}), 400
 
+    # お祭りごとのお気に入り数の増減を計算
+    deltas = {festival_id: 1 for festival_id in new_ids}
+    for (festival_id,) in db.session.query(UserFavorite.festival_id).filter_by(user_id=user_id):
+        deltas[festival_id] = deltas.get(festival_id, 0) - 1
+
+    # 既存のお気に入りをすべて削除
+    UserFavorite.query.filter_by(user_id=user_id).delete()
+
+    # 新しいお気に入りを追加
+    for festival_id in new_ids:
+        db.session.add(UserFavorite(user_id=user_id, festival_id=festival_id))
+
+    adjust_favorite_counts(deltas)
     db.session.commit()
+    cache.bump_version(cache.FAVORITES)
     return jsonify({'message': 'Favorites updated successfully'}), 200
 
 # PATCH /api/account/profile : プロフィール情報（ユーザー名・パスワード）を更新
@@ -541,6 +1107,7 @@ def update_profile():
         user.set_password(new_password)
 
     db.session.commit()
+    cache.bump_version(cache.USERS)
     return jsonify({
         'message': 'プロフィールを更新しました',
         'user': {'id': user.id, 'username': user.userID, 'userID': user.userID, 'email': user.email, 'display_name': user.username, 'is_admin': user.is_administrator}
@@ -998,6 +1565,7 @@ def change_user_role(user_id):
          
     user.is_admin = is_admin_flag
     db.session.commit()
+    cache.bump_version(cache.USERS)
     return jsonify({'message': 'Role updated'}), 200
 
 @api_bp.route('/admin/users/<int:user_id>', methods=['PUT', 'DELETE'])
@@ -1039,6 +1607,7 @@ def manage_admin_user(user_id):
             user.set_password(password)
 
         db.session.commit()
+        cache.bump_version(cache.USERS)
         return jsonify({'message': 'ユーザー情報を更新しました', 'user': {'id': user.id, 'username': user.userID}}), 200
 
     elif request.method == 'DELETE':
@@ -1046,26 +1615,38 @@ def manage_admin_user(user_id):
             return jsonify({'error': 'rootユーザー自身を削除することはできません'}), 400
 
         # 関連データの削除（外部キー制約エラーを防ぐため）
+        fav_counts = db.session.query(UserFavorite.festival_id, func.count(UserFavorite.id)).filter_by(user_id=user_id).group_by(UserFavorite.festival_id).all()
+        adjust_favorite_counts({festival_id: -count for festival_id, count in fav_counts})
         UserFavorite.query.filter_by(user_id=user_id).delete()
+        review_counts = db.session.query(Review.festival_id, Review.rating, func.count(Review.id)).filter_by(user_id=user_id).group_by(Review.festival_id, Review.rating).all()
+        for festival_id, rating, count in review_counts:
+            if rating in RATING_VALUES:
+                adjust_rating_stats(festival_id, rating, -count)
         Review.query.filter_by(user_id=user_id).delete()
         EditLog.query.filter_by(user_id=user_id).delete()
         Passkey.query.filter_by(user_id=user_id).delete()
         
         db.session.delete(user)
         db.session.commit()
+        cache.bump_version(cache.FAVORITES, cache.REVIEWS, cache.USERS)
         return jsonify({'message': 'ユーザーを削除しました'}), 200
 
 # --- Admin Settings API ---
 
 @api_bp.route('/admin/settings', methods=['GET'])
 def get_site_settings():
+    etag = cache.make_etag('settings', cache.get_version(cache.SETTINGS))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
     # Settings are stored in a single row, get it or create a default one.
     settings = SiteSettings.query.first()
     if not settings:
         settings = SiteSettings()
         db.session.add(settings)
         db.session.commit()
-    return jsonify(settings.to_dict())
+    return with_etag(jsonify(settings.to_dict()), etag)
 
 @api_bp.route('/admin/settings', methods=['POST'])
 @token_required
@@ -1087,10 +1668,22 @@ def update_site_settings():
         settings.line_login_enabled = data['lineLogin']
     
     db.session.commit()
+    cache.bump_version(cache.SETTINGS)
     
     return jsonify({'message': '設定を更新しました'}), 200
+
+# GET /api/admin/cache-stats : プロセス内キャッシュのヒット率・再構築時間を取得
+@api_bp.route('/admin/cache-stats', methods=['GET'])
+@token_required
+def get_cache_stats():
+    if not g.current_user.is_administrator:
+        return jsonify({'error': '権限がありません'}), 403
+
+    return jsonify({'pid': os.getpid(), 'caches': cache.all_stats(), 'password_pool': password_pool.stats()}), 200
+
 # --- Static Files API ---
 
+# ファイル名は一意なので immutable の長期キャッシュを付ける（ETag・Range・X-Accel-Redirect は app/uploads.py）
 @api_bp.route('/uploads/<filename>')
 def serve_uploaded_file(filename):
-    return send_from_directory(os.path.join(current_app.root_path, 'static', 'uploads'), filename)
+    return uploads.send_upload(filename)
@@ -0,0 +1,335 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import DataVersion
+
+# --- データバージョン ---
+# gunicorn の複数ワーカーや複数台のサーバー間でキャッシュの鮮度を揃えるため、
+# データの種類（ドメイン）ごとの更新カウンタを DB の data_versions テーブルに保存する。
+# 書き込み系APIはコミット後に bump_version() を呼び、読み取り側は get_versions() で手元のキャッシュや
+# ETag が最新かどうかを判定する。読み取りのたびに DB へ問い合わせないよう、各プロセスは全カウンタを
+# 1回のクエリで読んだスナップショットを DATA_VERSION_TTL 秒（既定 1秒）だけ使い回す。
+# 自プロセスの bump_version() はスナップショットにすぐ反映し、他のワーカー・サーバーの更新は最大 TTL 遅れて反映される
+# （0 にすると毎回 DB を読む）。カウンタは db.session とは別の接続で読み書きし、リクエスト中のトランザクションの影響を受けない。
+
+FESTIVALS = "festivals"
+PHOTOS = "photos"
+FAVORITES = "favorites"
+REVIEWS = "reviews"
+SETTINGS = "settings"
+USERS = "users"
+
+ALL_DOMAINS = (FESTIVALS, PHOTOS, FAVORITES, REVIEWS, SETTINGS, USERS)
+
+# ETag の衝突を防ぐランダムな識別子を version 列に持つ行
+EPOCH = "epoch"
+
+_epoch = None
+_versions = DataVersion.__table__
+# {name: (version, updated_at)} と読み込んだ時刻（time.monotonic()）。辞書は変更せずに差し替える
+_snapshot = {}
+_snapshot_at = None
+_snapshot_lock = threading.Lock()
+
+
+def _merge(rows):
+    """スナップショットに行を反映する（読み込み中に自プロセスで進めたバージョンを古い値で戻さない）"""
+    global _snapshot
+    merged = dict(_snapshot)
+    for name, version, updated_at in rows:
+        if name == EPOCH or name not in merged or version >= merged[name][0]:
+            merged[name] = (version, updated_at)
+    _snapshot = merged
+
+
+def _current(refresh=False):
+    """バージョンのスナップショット（TTL を過ぎていれば DB から読み直す）"""
+    global _snapshot_at
+    ttl = current_app.config.get("DATA_VERSION_TTL", 1.0)
+    if not refresh and _snapshot_at is not None and time.monotonic() - _snapshot_at < ttl:
+        return _snapshot
+    with _snapshot_lock:
+        # ロック待ちの間に別スレッドが読み直した場合
+        if not refresh and _snapshot_at is not None and time.monotonic() - _snapshot_at < ttl:
+            return _snapshot
+        with db.engine.connect() as conn:
+            rows = conn.execute(select(_versions.c.name, _versions.c.version, _versions.c.updated_at)).all()
+        _merge(rows)
+        _snapshot_at = time.monotonic()
+        return _snapshot
+
+
+def _create(name, version=0):
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(_versions).values(name=name, version=version, updated_at=datetime.utcnow()))
+    except IntegrityError:
+        pass  # 別のワーカーが先に作成した
+
+
+def get_versions(*names):
+    """ドメインの現在のバージョン番号を names の順のタプルで返す（未更新なら 0）"""
+    snapshot = _current()
+    return tuple(snapshot[name][0] if name in snapshot else 0 for name in names)
+
+
+def get_version(name):
+    return get_versions(name)[0]
+
+
+def get_version_mtime(name):
+    """ドメインが最後に更新された時刻（UNIX時間）。未更新ならバージョン管理の開始時刻"""
+    get_epoch()
+    snapshot = _current()
+    entry = snapshot.get(name) or snapshot.get(EPOCH) or _current(refresh=True)[EPOCH]
+    return entry[1].replace(tzinfo=timezone.utc).timestamp()
+
+
+def get_epoch():
+    """
+    バージョン管理の開始時に決めるランダムな識別子。
+    DB が作り直されてカウンタが 0 に戻っても、以前のETagと衝突しないようにする。
+    """
+    global _epoch
+    if _epoch is None:
+        entry = _current().get(EPOCH)
+        if entry is None:
+            _create(EPOCH, uuid.uuid4().int & 0x7fffffff)
+            entry = _current(refresh=True)[EPOCH]
+        _epoch = f"{entry[0]:08x}"
+    return _epoch
+
+
+def make_etag(kind, *parts):
+    """バージョン番号などから強いETag（引用符なし）を組み立てる"""
+    return "-".join([kind, get_epoch(), *(str(p) for p in parts)])
+
+
+def bump_version(*names):
+    """
+    ドメインのバージョンを1つ進める。必ず db.session.commit() の後に呼ぶこと。
+    :return: {name: (旧バージョン, 新バージョン)}
+    """
+    names = sorted(set(names))  # 複数のドメインを同時に進める書き込み同士が行ロックを逆順に待たないようにする
+    for name in set(names) - set(_current(refresh=True)):
+        _create(name)
+    result = {}
+    rows = []
+    with db.engine.begin() as conn:
+        for name in names:
+            # UPDATE で行ロックを取るため、同じドメインを同時に進めても番号は重複しない
+            now = datetime.utcnow()
+            conn.execute(
+                update(_versions).where(_versions.c.name == name).values(version=_versions.c.version + 1, updated_at=now)
+            )
+            new = conn.execute(select(_versions.c.version).where(_versions.c.name == name)).scalar_one()
+            result[name] = (new - 1, new)
+            rows.append((name, new, now))
+    with _snapshot_lock:
+        _merge(rows)
+    return result
+
+
+# --- バージョン付きキャッシュ ---
+
+_registry = {}
+
+
+class VersionedCache:
+    """
+    依存ドメインのバージョンが変わった時だけ build() をやり直すプロセス内キャッシュ。
+    サブクラスは build() を実装する。
+    """
+
+    def __init__(self, name, domains):
+        self.name = name
+        self.domains = tuple(domains)
+        self.version = None
+        self.value = None
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+        self.total_rebuild_ms = 0.0
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def current_version(self):
+        return get_versions(*self.domains)
+
+    def build(self):
+        raise NotImplementedError
+
+    def get(self):
+        """最新のキャッシュ値を (バージョン, 値) で返す"""
+        version = self.current_version()
+        if version == self.version:
+            self.hits += 1
+            return self.version, self.value
+
+        with self._lock:
+            # ロック待ちの間に別スレッドが再構築済みの場合
+            if version == self.version:
+                self.hits += 1
+                return self.version, self.value
+
+            self.misses += 1
+            # ビルド前に読んだバージョンで記録する（ビルド中の更新は次回再構築される）
+            start = time.perf_counter()
+            value = self.build()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            self.value = value
+            self.version = version
+            self.rebuilds += 1
+            self.last_rebuild_ms = elapsed_ms
+            self.total_rebuild_ms += elapsed_ms
+            return self.version, self.value
+
+    def finish(self, value):
+        """build() や apply_update() で作った値を読み取りに公開する前の仕上げ（サブクラスで必要なら実装する）"""
+
+    def apply_update(self, bumped, update):
+        """
+        自プロセスでの書き込みを、全体を再構築せずにキャッシュへ反映する。
+        書き込み直前のバージョンでキャッシュが最新だった場合のみ、値の copy() に update(値) を適用して
+        差し替え、新しいバージョンを記録する。そうでなければ何もせず、次回の get() で再構築させる。
+        読み取り側はロックを取らずに値を使うため、公開済みの値は変更しない（値は copy() を実装すること）。
+        :param bumped: bump_version() の戻り値
+        """
+        with self._lock:
+            if self.version is None:
+                return
+            before = tuple(bumped.get(d, (v, v))[0] for d, v in zip(self.domains, self.version))
+            if before != self.version:
+                return
+            value = self.value.copy()
+            update(value)
+            self.finish(value)
+            self.value = value
+            self.version = tuple(bumped.get(d, (v, v))[1] for d, v in zip(self.domains, self.version))
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+            self.value = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "version": list(self.version) if self.version else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": round(self.last_rebuild_ms, 3),
+            "avg_rebuild_ms": round(self.total_rebuild_ms / self.rebuilds, 3) if self.rebuilds else None,
+        }
+
+
+class JSONSnapshot(VersionedCache):
+    """builder() の結果をシリアライズ済みのJSONバイト列として保持するスナップショット"""
+
+    def __init__(self, name, domains, builder):
+        super().__init__(name, domains)
+        self.builder = builder
+
+    def build(self):
+        return current_app.json.dumps(self.builder()).encode("utf-8") + b"\n"
+
+
+class LRUCache:
+    """
+    キーごとの値を最大 maxsize 件・ttl 秒まで保持するプロセス内キャッシュ。
+    各エントリには取得時の依存ドメインのバージョンを記録し、bump_version() された後は読み直す。
+    """
+
+    def __init__(self, name, domains, maxsize=1024, ttl=60.0):
+        self.name = name
+        self.domains = tuple(domains)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (バージョン, 期限, 値)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def current_version(self):
+        return get_versions(*self.domains)
+
+    def get(self, key, loader):
+        """
+        キャッシュ済みの値を返す。無い・期限切れ・古いバージョンの場合は loader() の結果を保存して返す
+        （loader() が None を返した場合は保存しない）
+        """
+        version = self.current_version()
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            if entry is not None:
+                self.expired += 1
+
+        # DBへの問い合わせ中はロックを持たない（同じキーの同時取得は重複しても問題ない）
+        value = loader()
+        if value is None:
+            return None
+        with self._lock:
+            self.entries[key] = (version, now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key=None):
+        """key のエントリを捨てる（省略時はすべて）"""
+        with self._lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "version": list(self.current_version()),
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+
+def warm_all():
+    """登録済みのキャッシュをすべて構築する（ワーカー起動時用）"""
+    for c in _registry.values():
+        if not isinstance(c, VersionedCache):
+            continue
+        try:
+            c.get()
+        except Exception as e:
+            current_app.logger.warning(f"Cache warm-up failed for {c.name}: {e}")
+
+
+def all_stats():
+    return [c.stats() for c in _registry.values()]
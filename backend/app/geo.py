@@ -0,0 +1,246 @@
+import heapq
+import math
+from collections import defaultdict
+from . import db, cache
+from .models import Festivals
+
+EARTH_RADIUS_KM = 6371.0088
+# Webメルカトルで表示できる緯度の上限
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """2点間の大円距離(km)"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    緯度経度を固定サイズのセルに分割したグリッド空間インデックス。
+    検索地点のセルから外側へリング状に探索し、未探索のセルに
+    より近い点が存在し得なくなった時点で打ち切る。
+    """
+
+    def __init__(self, points, cell_deg=0.05):
+        """
+        :param points: (id, latitude, longitude) のリスト
+        :param cell_deg: セルの一辺（度）。0.05度 ≒ 南北5.6km
+        """
+        self.cell_deg = cell_deg
+        self.cells = defaultdict(list)
+        for point in points:
+            self.cells[self._cell(point[1], point[2])].append(point)
+        self.size = len(points)
+
+        if self.cells:
+            rows = [r for r, _ in self.cells]
+            cols = [c for _, c in self.cells]
+            self.bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self.bounds = None
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _ring(self, row, col, r):
+        """(row, col) からチェビシェフ距離 r にあるセル"""
+        if r == 0:
+            yield (row, col)
+            return
+        for c in range(col - r, col + r + 1):
+            yield (row - r, c)
+            yield (row + r, c)
+        for rr in range(row - r + 1, row + r):
+            yield (rr, col - r)
+            yield (rr, col + r)
+
+    def _max_ring(self, row, col):
+        """データが存在するセル範囲をすべて覆うのに必要なリング数"""
+        min_row, max_row, min_col, max_col = self.bounds
+        return max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+    def _ring_lower_bound_km(self, lat, r):
+        """リング r より外側にある点までの距離の下限(km)"""
+        span_deg = r * self.cell_deg
+        # 経度方向の距離は高緯度ほど縮むため、探索範囲で最も高緯度の地点で見積もる
+        worst_lat = min(89.9, abs(lat) + span_deg)
+        return haversine_km(worst_lat, 0.0, worst_lat, span_deg)
+
+    def nearest(self, lat, lng, k=10, radius_km=None):
+        """
+        (lat, lng) に近い順に最大 k 件を返す
+        :return: [(distance_km, point), ...]
+        """
+        if not self.bounds or k <= 0:
+            return []
+
+        row, col = self._cell(lat, lng)
+        max_ring = self._max_ring(row, col)
+        best = []  # (-distance, id, point) の最大ヒープ
+
+        r = 0
+        while r <= max_ring:
+            for cell in self._ring(row, col, r):
+                for point in self.cells.get(cell, ()):
+                    d = haversine_km(lat, lng, point[1], point[2])
+                    if radius_km is not None and d > radius_km:
+                        continue
+                    item = (-d, point[0], point)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+
+            bound = self._ring_lower_bound_km(lat, r)
+            if radius_km is not None and bound > radius_km:
+                break
+            if len(best) == k and bound > -best[0][0]:
+                break
+            r += 1
+
+        return [(-neg_d, point) for neg_d, _, point in sorted(best, reverse=True)]
+
+
+def mercator_xy(lat, lng):
+    """緯度経度を Webメルカトルの正規化座標 (0〜1, 0〜1) に変換する"""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lng + 180.0) / 360.0
+    s = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12)
+
+
+class ClusterPyramid:
+    """
+    ズームレベルごとのクラスタを事前集計した階層グリッド。
+    ズーム z のセルは地図タイル1枚を 2^CELL_SHIFT 分割した大きさ（256px タイルなら 64px 四方）で、
+    最大ズームで集計した後、親セル（座標を1ビット右シフト）へ順に畳み込んで全レベルを作る。
+    """
+
+    CELL_SHIFT = 2
+    MAX_ZOOM = 18
+
+    def __init__(self, points):
+        """
+        :param points: (id, latitude, longitude, weight) のリスト。weight が最大の点を代表点とする
+        """
+        self.levels = [None] * (self.MAX_ZOOM + 1)
+
+        bits = self.MAX_ZOOM + self.CELL_SHIFT
+        size = 1 << bits
+        level = {}
+        for fid, lat, lng, weight in points:
+            x, y = mercator_xy(lat, lng)
+            key = (int(x * size), int(y * size))
+            self._merge(level, key, (1, lat, lng, (weight or 0, -fid), fid))
+        self.levels[self.MAX_ZOOM] = level
+
+        for zoom in range(self.MAX_ZOOM - 1, -1, -1):
+            parent = {}
+            for (cx, cy), cell in self.levels[zoom + 1].items():
+                self._merge(parent, (cx >> 1, cy >> 1), cell)
+            self.levels[zoom] = parent
+
+    @staticmethod
+    def _merge(level, key, cell):
+        """セル（件数, 緯度合計, 経度合計, 代表点の優先度, 代表点ID）を加算する"""
+        current = level.get(key)
+        if current is None:
+            level[key] = cell
+            return
+        count, sum_lat, sum_lng, rank, rep = current
+        if cell[3] > rank:
+            rank, rep = cell[3], cell[4]
+        level[key] = (count + cell[0], sum_lat + cell[1], sum_lng + cell[2], rank, rep)
+
+    def query(self, west, south, east, north, zoom):
+        """
+        表示範囲に含まれるクラスタを返す
+        :return: [{'count', 'latitude', 'longitude', 'representative_id'}, ...]
+        """
+        zoom = max(0, min(self.MAX_ZOOM, zoom))
+        level = self.levels[zoom]
+        size = 1 << (zoom + self.CELL_SHIFT)
+
+        x0, y0 = mercator_xy(north, west)
+        x1, y1 = mercator_xy(south, east)
+        min_x, max_x = int(x0 * size), int(x1 * size)
+        min_y, max_y = int(y0 * size), int(y1 * size)
+
+        # 範囲内のセル数とデータのあるセル数のうち少ない方を走査する
+        if (max_x - min_x + 1) * (max_y - min_y + 1) <= len(level):
+            keys = ((x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1))
+            cells = ((key, level[key]) for key in keys if key in level)
+        else:
+            cells = (
+                (key, cell) for key, cell in level.items()
+                if min_x <= key[0] <= max_x and min_y <= key[1] <= max_y
+            )
+
+        clusters = []
+        for _, (count, sum_lat, sum_lng, _, rep) in cells:
+            clusters.append({
+                'count': count,
+                'latitude': sum_lat / count,
+                'longitude': sum_lng / count,
+                'representative_id': rep,
+            })
+        return clusters
+
+
+class FestivalGeoIndex(cache.VersionedCache):
+    """お祭りの位置情報から作るグリッドインデックス（お祭りの更新時に再構築）"""
+
+    def build(self):
+        rows = db.session.query(
+            Festivals.id, Festivals.latitude, Festivals.longitude,
+            Festivals.name, Festivals.date, Festivals.location,
+        ).filter(Festivals.latitude.isnot(None), Festivals.longitude.isnot(None)).all()
+
+        points = []
+        summaries = {}
+        for row in rows:
+            # 登録APIは文字列の座標も受け付けているため数値に揃える
+            try:
+                lat, lng = float(row.latitude), float(row.longitude)
+            except (TypeError, ValueError):
+                continue
+            points.append((row.id, lat, lng))
+            summaries[row.id] = {
+                'id': row.id,
+                'name': row.name,
+                'date': row.date.strftime('%Y-%m-%d') if row.date else None,
+                'location': row.location,
+                'latitude': lat,
+                'longitude': lng,
+            }
+        return GridIndex(points), summaries
+
+
+festival_geo_index = FestivalGeoIndex('festival_geo_index', (cache.FESTIVALS,))
+
+
+class FestivalClusterIndex(cache.VersionedCache):
+    """地図マーカー用のクラスタ階層（お祭りの更新時に再構築）"""
+
+    def build(self):
+        rows = db.session.query(
+            Festivals.id, Festivals.latitude, Festivals.longitude, Festivals.attendance,
+        ).filter(Festivals.latitude.isnot(None), Festivals.longitude.isnot(None)).all()
+
+        points = []
+        for row in rows:
+            try:
+                lat, lng = float(row.latitude), float(row.longitude)
+            except (TypeError, ValueError):
+                continue
+            # 来場者数の多いお祭りをクラスタの代表にする
+            points.append((row.id, lat, lng, row.attendance))
+        return ClusterPyramid(points)
+
+
+festival_cluster_index = FestivalClusterIndex('festival_cluster_index', (cache.FESTIVALS,))
@@ -0,0 +1,253 @@
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow がない環境では元画像のみを保存する
+    Image = None
+
+# --- 写真の派生画像 ---
+# アップロード時に長辺を VARIANT_SIZES に縮小した画像を WebP と JPEG で作り、
+# 一覧や地図では小さい画像を srcset で選ばせる。EXIF（位置情報など）は書き出さず、
+# 向きだけは画素に反映しておく。元画像より大きいサイズは作らない。
+
+VARIANT_SIZES = {'thumb': 320, 'medium': 800, 'large': 1600}
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+SAVE_OPTIONS = {
+    'WEBP': {'quality': 80, 'method': 4},
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def is_available():
+    return Image is not None
+
+
+def _prepare(image, fmt):
+    """書き出し形式に合わせて色空間を揃える（JPEG は透過を白背景に合成する）"""
+    if fmt == 'JPEG':
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        return image.convert('RGB') if image.mode != 'RGB' else image
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+    return image
+
+
+def generate_variants(source_path, output_dir, stem):
+    """
+    source_path の画像から派生画像を output_dir に書き出す
+    :param stem: 出力ファイル名の元（'<stem>_<size>.<ext>' になる）
+    :return: [{'size', 'format', 'width', 'height', 'filename'}, ...]（画像として読めない場合は空）
+    """
+    if Image is None:
+        return []
+    try:
+        with Image.open(source_path) as opened:
+            opened.load()
+            original = ImageOps.exif_transpose(opened)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return []
+
+    variants = []
+    longest = max(original.size)
+    for size, max_edge in VARIANT_SIZES.items():
+        # 元画像より大きいサイズは作らない（最小サイズだけは元の大きさで必ず作る）
+        if max_edge > longest and variants:
+            break
+        resized = original.copy()
+        resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        for ext, fmt in VARIANT_FORMATS.items():
+            filename = f"{stem}_{size}.{ext}"
+            # exif を渡さずに保存するため、元画像の EXIF は引き継がれない
+            _prepare(resized, fmt).save(os.path.join(output_dir, filename), fmt, **SAVE_OPTIONS[fmt])
+            variants.append({
+                'size': size, 'format': ext,
+                'width': resized.width, 'height': resized.height,
+                'filename': filename,
+            })
+    return variants
+
+
+# --- 元画像のメタデータの除去 ---
+# 元画像はそのまま配信するため、保存前に EXIF（撮影日時・機種・位置情報など）と XMP・IPTC・コメントを取り除く。
+# 画素データは再エンコードせずにバイト列のまま写す（画質は変わらない）。向き（EXIF の Orientation）が
+# 1 以外の場合は、向きだけを持つ最小の EXIF を入れ直す（派生画像の exif_transpose もこれを使う）。
+#   JPEG : APP1（EXIF・XMP）、APP3〜APP13・APP15、COM を除く（APP0・APP2（ICC）・APP14 は残す）
+#   PNG  : eXIf、tEXt、zTXt、iTXt、tIME を除く
+#   WebP : EXIF、XMP を除き、VP8X のフラグと RIFF のサイズを直す
+#   GIF  : 位置情報を持たないためそのまま
+
+JPEG_KEEP_APP = {0xE0, 0xE2, 0xEE}
+PNG_DROP_CHUNKS = {b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+WEBP_DROP_CHUNKS = {b'EXIF', b'XMP '}
+EXIF_HEADER = b'Exif\x00\x00'
+ORIENTATION_TAG = 0x0112
+
+
+def strip_metadata(path, ext):
+    """
+    path の画像からメタデータを取り除いて置き換える
+    :param ext: sniff_image_ext で判定した拡張子
+    :return: 書き換え後のファイルサイズ
+    :raises ValueError: 画像の構造が壊れている場合
+    """
+    writer = {'.jpg': _strip_jpeg, '.png': _strip_png, '.webp': _strip_webp}.get(ext)
+    if writer is None:
+        return os.path.getsize(path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.strip-', suffix='.tmp')
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'w+b') as dst:
+            writer(src, dst)
+            size = dst.tell()
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return size
+
+
+def _read(src, length):
+    data = src.read(length)
+    if len(data) != length:
+        raise ValueError('truncated image')
+    return data
+
+
+def _copy(src, dst, length):
+    """src から length バイトをそのまま dst へ写す"""
+    while length > 0:
+        data = src.read(min(length, 64 * 1024))
+        if not data:
+            raise ValueError('truncated image')
+        dst.write(data)
+        length -= len(data)
+
+
+def _exif_orientation(tiff):
+    """TIFF 形式の EXIF（先頭の EXIF_HEADER は除いたもの）の IFD0 から向きを読む（なければ 1）"""
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        offset, = struct.unpack_from(order + 'I', tiff, 4)
+        count, = struct.unpack_from(order + 'H', tiff, offset)
+        for i in range(count):
+            tag, kind, _, value = struct.unpack_from(order + 'HHIH', tiff, offset + 2 + i * 12)
+            if tag == ORIENTATION_TAG and kind == 3:
+                return value if 1 <= value <= 8 else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def _orientation_exif(orientation):
+    """向きだけを持つ TIFF 形式の EXIF"""
+    return b'MM\x00\x2a' + struct.pack('>IHHHIHHI', 8, 1, ORIENTATION_TAG, 3, 1, orientation, 0, 0)
+
+
+def _strip_jpeg(src, dst):
+    if _read(src, 2) != b'\xff\xd8':
+        raise ValueError('not a JPEG')
+    dst.write(b'\xff\xd8')
+    orientation_written = False
+    while True:
+        if _read(src, 1) != b'\xff':
+            raise ValueError('marker expected')
+        marker = _read(src, 1)[0]
+        while marker == 0xFF:  # マーカー前の埋め草
+            marker = _read(src, 1)[0]
+        if marker == 0xD9:  # EOI
+            dst.write(b'\xff\xd9')
+            return
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:  # 長さを持たないマーカー
+            dst.write(bytes((0xFF, marker)))
+            continue
+        length, = struct.unpack('>H', _read(src, 2))
+        if length < 2:
+            raise ValueError('bad segment length')
+        if marker in (0xE1, 0xFE) or (0xE3 <= marker <= 0xEF and marker not in JPEG_KEEP_APP):
+            payload = _read(src, length - 2)
+            if marker == 0xE1 and payload.startswith(EXIF_HEADER) and not orientation_written:
+                orientation = _exif_orientation(payload[len(EXIF_HEADER):])
+                if orientation != 1:
+                    exif = EXIF_HEADER + _orientation_exif(orientation)
+                    dst.write(b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif)
+                    orientation_written = True
+            continue
+        dst.write(bytes((0xFF, marker)) + struct.pack('>H', length))
+        _copy(src, dst, length - 2)
+        if marker == 0xDA:  # SOS 以降は画素データなのでそのまま写す
+            shutil.copyfileobj(src, dst)
+            return
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _strip_png(src, dst):
+    signature = _read(src, 8)
+    if signature != b'\x89PNG\r\n\x1a\n':
+        raise ValueError('not a PNG')
+    dst.write(signature)
+    while True:
+        length, kind = struct.unpack('>I4s', _read(src, 8))
+        if kind in PNG_DROP_CHUNKS:
+            data = _read(src, length)
+            _read(src, 4)
+            if kind == b'eXIf':
+                tiff = data[len(EXIF_HEADER):] if data.startswith(EXIF_HEADER) else data
+                orientation = _exif_orientation(tiff)
+                if orientation != 1:
+                    dst.write(_png_chunk(b'eXIf', _orientation_exif(orientation)))
+            continue
+        dst.write(struct.pack('>I4s', length, kind))
+        _copy(src, dst, length + 4)
+        if kind == b'IEND':
+            return
+
+
+def _strip_webp(src, dst):
+    riff, _, form = struct.unpack('<4sI4s', _read(src, 12))
+    if riff != b'RIFF' or form != b'WEBP':
+        raise ValueError('not a WebP')
+    dst.write(struct.pack('<4sI4s', riff, 0, form))
+    flags_at = None
+    has_exif = False
+    while True:
+        header = src.read(8)
+        if not header:
+            break
+        if len(header) != 8:
+            raise ValueError('truncated image')
+        kind, length = struct.unpack('<4sI', header)
+        padded = length + (length & 1)
+        if kind in WEBP_DROP_CHUNKS:
+            data = _read(src, padded)[:length]
+            if kind == b'EXIF' and not has_exif:
+                tiff = data[len(EXIF_HEADER):] if data.startswith(EXIF_HEADER) else data
+                orientation = _exif_orientation(tiff)
+                if orientation != 1:
+                    exif = _orientation_exif(orientation)
+                    dst.write(struct.pack('<4sI', b'EXIF', len(exif)) + exif)
+                    has_exif = True
+            continue
+        if kind == b'VP8X':
+            flags_at = dst.tell() + 8
+        dst.write(header)
+        _copy(src, dst, padded)
+    size = dst.tell()
+    dst.seek(4)
+    dst.write(struct.pack('<I', size - 8))
+    if flags_at is not None:
+        # EXIF（0x08）と XMP（0x04）のフラグを実際に残したチャンクに合わせる
+        dst.seek(flags_at)
+        flags = _read(dst, 1)[0] & ~0x0C | (0x08 if has_exif else 0)
+        dst.seek(flags_at)
+        dst.write(bytes((flags,)))
+    dst.seek(size)
@@ -1,13 +1,18 @@
-from . import db, bcrypt
+from . import db, passwords
 from datetime import datetime
 
+# レビューで選択できる評価
+RATING_VALUES = (1, 2, 3, 4, 5)
+
 
 class Festivals(db.Model):
     __tablename__ = "festivals"
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80))
-    date = db.Column(db.Date)
+    # 読み仮名（検索候補の入力補完に使用）
+    name_kana = db.Column(db.String(160), nullable=True)
+    date = db.Column(db.Date, index=True)
     location = db.Column(db.String(225))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
@@ -15,12 +20,33 @@ class Festivals(db.Model):
     attend_year = db.Column(db.Integer, default=0)
     description = db.Column(db.Text, nullable=True)
     access = db.Column(db.String(255), nullable=True)
+    # お気に入り登録数（user_favorites の件数を非正規化して保持。flask repair-favorite-counts で再計算）
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # レビュー評価の集計（reviews を走査せずに平均・分布を返すため非正規化して保持）
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # 一覧APIの内容（写真・お気に入り数・評価を含む）が最後に変わった日時。差分同期に使用
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    def rating_summary(self):
+        return {
+            "festival_id": self.id,
+            "count": self.rating_count,
+            "average": round(self.rating_sum / self.rating_count, 2) if self.rating_count else None,
+            "histogram": {str(r): getattr(self, f"rating_{r}") for r in RATING_VALUES},
+        }
     
 
     def to_dict(self):
         return {
             "id": self.id,
             "name": self.name,
+            "name_kana": self.name_kana,
             "date": self.date.strftime("%Y-%m-%d") if self.date else None,
             "location": self.location,
             "latitude": self.latitude,
@@ -39,18 +65,56 @@ class FestivalPhoto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     festival_id = db.Column(db.Integer, db.ForeignKey("festivals.id"), nullable=False)
     image_url = db.Column(db.String(255), nullable=False)
+    # 画像ファイルの実体（upload_blobs.content_hash）。内容のハッシュ名で保存する前の写真は None
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     festival = db.relationship("Festivals", backref=db.backref("photos", lazy=True))
+    variants = db.relationship(
+        "FestivalPhotoVariant", backref="photo", lazy=True, cascade="all, delete-orphan",
+        order_by="FestivalPhotoVariant.width",
+    )
 
     def to_dict(self):
+        # srcset: {"webp": "<url> 320w, <url> 800w", "jpeg": ...}。派生画像がない写真は空
+        srcset = {}
+        thumbnail_url = None
+        for variant in self.variants:
+            srcset.setdefault(variant.format, []).append(f"{variant.image_url} {variant.width}w")
+            if variant.size == "thumb" and variant.format == "jpeg":
+                thumbnail_url = variant.image_url
         return {
             "id": self.id,
             "festival_id": self.festival_id,
             "image_url": self.image_url,
+            "thumbnail_url": thumbnail_url or self.image_url,
+            "srcset": {fmt: ", ".join(entries) for fmt, entries in srcset.items()},
             "created_at": self.created_at.isoformat() if self.created_at else None
         }
 
+class FestivalPhotoVariant(db.Model):
+    """写真の縮小版（app/images.py でアップロード時に作成）"""
+    __tablename__ = "festival_photo_variants"
+
+    id = db.Column(db.Integer, primary_key=True)
+    photo_id = db.Column(db.Integer, db.ForeignKey("festival_photos.id"), nullable=False, index=True)
+    size = db.Column(db.String(10), nullable=False)  # 'thumb' / 'medium' / 'large'
+    format = db.Column(db.String(10), nullable=False)  # 'webp' / 'jpeg'
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    image_url = db.Column(db.String(255), nullable=False)
+
+class UploadBlob(db.Model):
+    """アップロードされたファイルの実体（内容の SHA-256 で保存し、同じ画像は共有する。app/uploads.py）"""
+    __tablename__ = "upload_blobs"
+
+    content_hash = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    # 参照している festival_photos の行数。0 になったら縮小版を含めてファイルを削除する
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class User(db.Model):
     __tablename__ = "users"
 
@@ -81,12 +145,20 @@ class User(db.Model):
         return self.is_admin or self.username == 'root'
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
+        """
+        パスワードを照合する。一致し、保存済みハッシュのコストが BCRYPT_LOG_ROUNDS と異なる場合は
+        現在のコストで作り直す（呼び出し元でコミットすること）
+        """
         if not self.password_hash:
             return False
-        return bcrypt.check_password_hash(self.password_hash, password)
+        if not passwords.check_password(password, self.password_hash):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
 class Passkey(db.Model):
     __tablename__ = "passkeys"
@@ -98,6 +170,38 @@ class Passkey(db.Model):
     sign_count = db.Column(db.Integer, default=0)
     transports = db.Column(db.String(255), nullable=True)
 
+def touch_festival(festival_id):
+    """写真の追加・削除など、festivals 以外の変更でお祭りの updated_at を進める"""
+    Festivals.query.filter_by(id=festival_id).update(
+        {Festivals.updated_at: datetime.utcnow()}, synchronize_session=False
+    )
+
+def adjust_favorite_counts(deltas):
+    """
+    お祭りごとのお気に入り数を増減する（呼び出し元のトランザクション内で実行）
+    :param deltas: {festival_id: 増減数}
+    """
+    by_delta = {}
+    for festival_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(festival_id)
+    for delta, festival_ids in by_delta.items():
+        Festivals.query.filter(Festivals.id.in_(festival_ids)).update(
+            {Festivals.favorite_count: Festivals.favorite_count + delta}, synchronize_session=False
+        )
+
+def adjust_rating_stats(festival_id, rating, count=1):
+    """
+    レビューの追加（count > 0）・削除（count < 0）をお祭りの評価集計に反映する
+    （呼び出し元のトランザクション内で実行）
+    """
+    histogram = getattr(Festivals, f"rating_{rating}")
+    Festivals.query.filter_by(id=festival_id).update({
+        Festivals.rating_count: Festivals.rating_count + count,
+        Festivals.rating_sum: Festivals.rating_sum + rating * count,
+        histogram: histogram + count,
+    }, synchronize_session=False)
+
 class UserFavorite(db.Model):
     __tablename__ = "user_favorites"
 
@@ -133,6 +237,8 @@ class EditLog(db.Model):
 
 class Review(db.Model):
     __tablename__ = "reviews"
+    # お祭りごとのレビューを新しい順にページングするための複合インデックス
+    __table_args__ = (db.Index("ix_reviews_festival_id_created_at", "festival_id", "created_at"),)
 
     id = db.Column(db.Integer, primary_key=True)
     festival_id = db.Column(db.Integer, db.ForeignKey("festivals.id"), nullable=False)
@@ -209,4 +315,40 @@ class SiteSettings(db.Model):
             # Match the frontend's expectation (camelCase)
             'googleLogin': self.google_login_enabled,
             'lineLogin': self.line_login_enabled,
-        }
\ No newline at end of file
+        }
+
+class Tombstone(db.Model):
+    """差分同期のために削除されたお祭り・写真を記録する"""
+    __tablename__ = 'tombstones'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'festival' または 'photo'
+    record_id = db.Column(db.Integer, nullable=False)
+    festival_id = db.Column(db.Integer, nullable=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class OutboxEmail(db.Model):
+    """送信待ちのメール（app/outbox.py のバックグラウンド送信で処理する）"""
+    __tablename__ = 'email_outbox'
+    # 送信対象の取得（status と次回送信日時での絞り込み）用
+    __table_args__ = (db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    to = db.Column(db.String(255), nullable=False)  # カンマ区切り
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    # 'pending'（送信待ち）/ 'sending'（送信中。next_attempt_at までに終わらなければ再送対象）/ 'sent' / 'failed'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+class DataVersion(db.Model):
+    """データの種類ごとの更新カウンタ（app/cache.py。全ワーカー・全サーバーでキャッシュの鮮度を揃える）"""
+    __tablename__ = 'data_versions'
+
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
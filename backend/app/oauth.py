@@ -5,6 +5,7 @@ import jwt
 import datetime
 from .models import User
 from . import db
+from . import cache
 from urllib.parse import urlencode
 import re
 
@@ -115,6 +116,8 @@ def google_auth():
         })
 
     # 既存ユーザーの更新
+    # 表示名・メールアドレス・連携情報が変わった場合はレビューのETagと認証ユーザーのキャッシュを更新させる
+    profile_changed = not user.google_user_id or user.username != name or user.email != email
     if not user.google_user_id:
         user.google_user_id = google_user_id
     user.username = name
@@ -123,6 +126,8 @@ def google_auth():
     user.last_login_at = datetime.datetime.now(datetime.timezone.utc)
 
     db.session.commit()
+    if profile_changed:
+        cache.bump_version(cache.USERS)
 
     # ④ JWT 発行
     token = jwt.encode(
@@ -250,6 +255,11 @@ def line_auth():
         })
 
     # 既存ユーザーの更新
+    profile_changed = (
+        not user.line_user_id
+        or (bool(display_name) and user.username != display_name)
+        or (bool(email) and user.email != email)
+    )
     if not user.line_user_id:
         user.line_user_id = line_user_id
     user.username = display_name or user.username
@@ -258,6 +268,8 @@ def line_auth():
     user.last_login_at = datetime.datetime.now(datetime.timezone.utc)
 
     db.session.commit()
+    if profile_changed:
+        cache.bump_version(cache.USERS)
 
     # ④ JWT 発行（Googleと同じ）
     token = jwt.encode(
@@ -0,0 +1,178 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mailman import EmailMessage
+from . import db, mail
+from .models import OutboxEmail
+
+# --- メール送信キュー ---
+# リクエスト処理中は email_outbox テーブルに積むだけにして、SMTP への送信は
+# ワーカーごとのバックグラウンドスレッドが行う。1つの SMTP 接続を使い回して
+# OUTBOX_BATCH_SIZE 件ずつ送り、失敗したメールは間隔を倍々に空けて再送する。
+# 複数ワーカーが同じメールを送らないよう、送信前に行を条件付き UPDATE で確保する。
+#
+# 設定（create_app で環境変数から読み込む）:
+#   OUTBOX_SENDER         : このワーカーで送信スレッドを動かすか（既定 False。False なら積むだけで、
+#                           送信は True のワーカーが OUTBOX_POLL_INTERVAL ごとに拾うか flask send-outbox で行う）
+#   OUTBOX_BATCH_SIZE     : 1回に確保する件数（既定 20）
+#   OUTBOX_POLL_INTERVAL  : 他ワーカーが積んだメールや再送を確認する間隔（秒、既定 5）
+#   OUTBOX_MAX_ATTEMPTS   : この回数失敗したら 'failed' にする（既定 6）
+#   OUTBOX_RETRY_BASE     : 再送間隔の初期値（秒、既定 30。以降 2倍ずつ、最大 1時間）
+
+# 確保してから送信完了までの猶予。これを過ぎた 'sending' の行はプロセスが落ちたとみなして再送する
+CLAIM_LEASE = timedelta(minutes=5)
+MAX_RETRY_DELAY = timedelta(hours=1)
+# 送信がない状態がこの時間続いたら SMTP 接続を閉じる
+IDLE_DISCONNECT = timedelta(seconds=30)
+
+
+def enqueue_email(to, subject, body):
+    """
+    メールを送信キューに積む（呼び出し元でコミットし、その後 wake_outbox() を呼ぶ）
+    :param to: 宛先のリスト
+    """
+    message = OutboxEmail(to=",".join(to), subject=subject, body=body)
+    db.session.add(message)
+    return message
+
+
+def wake_outbox():
+    """
+    送信スレッドにキューを確認させる。必ず db.session.commit() の後に呼ぶこと
+    （OUTBOX_SENDER が False のワーカーではスレッドを起動しない）
+    """
+    if current_app.config.get("OUTBOX_SENDER"):
+        outbox_sender.start(current_app._get_current_object())
+
+
+def retry_delay(attempts):
+    base = timedelta(seconds=current_app.config.get("OUTBOX_RETRY_BASE", 30))
+    return min(base * (2 ** (attempts - 1)), MAX_RETRY_DELAY)
+
+
+def claim_batch(limit):
+    """送信対象を最大 limit 件確保して返す（他ワーカーが先に確保した行は除く）"""
+    now = datetime.utcnow()
+    candidates = [
+        row.id for row in db.session.query(OutboxEmail.id)
+        .filter(OutboxEmail.status.in_(("pending", "sending")), OutboxEmail.next_attempt_at <= now)
+        .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id)
+        .limit(limit)
+    ]
+    claimed = []
+    for message_id in candidates:
+        updated = OutboxEmail.query.filter(
+            OutboxEmail.id == message_id,
+            OutboxEmail.status.in_(("pending", "sending")),
+            OutboxEmail.next_attempt_at <= now,
+        ).update({OutboxEmail.status: "sending", OutboxEmail.next_attempt_at: now + CLAIM_LEASE},
+                 synchronize_session=False)
+        if updated:
+            claimed.append(message_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return OutboxEmail.query.filter(OutboxEmail.id.in_(claimed)).order_by(OutboxEmail.id).all()
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def send_batch(connection, messages):
+    """
+    確保したメールを connection で順に送り、結果を記録する
+    :return: 送信できた件数
+    """
+    max_attempts = current_app.config.get("OUTBOX_MAX_ATTEMPTS", 6)
+    sent = 0
+    for message in messages:
+        try:
+            # 先に接続しておくと send() は接続を閉じずに使い回す
+            connection.open()
+            EmailMessage(
+                subject=message.subject, body=message.body, to=message.to.split(","), connection=connection,
+            ).send()
+        except Exception as e:
+            message.attempts += 1
+            message.last_error = str(e)[:1000]
+            if message.attempts >= max_attempts:
+                message.status = "failed"
+                current_app.logger.error(f"Outbox email {message.id} failed permanently: {e}")
+            else:
+                message.status = "pending"
+                message.next_attempt_at = datetime.utcnow() + retry_delay(message.attempts)
+            # 接続が切れている可能性があるため、次のメールは接続し直して送る
+            close_quietly(connection)
+        else:
+            message.attempts += 1
+            message.status = "sent"
+            message.sent_at = datetime.utcnow()
+            message.last_error = None
+            sent += 1
+        db.session.commit()
+    return sent
+
+
+def flush_outbox():
+    """送信対象がなくなるまで送る（CLI・テスト用。バックグラウンドスレッドと同じ処理）"""
+    connection = mail.get_connection()
+    total = 0
+    try:
+        while True:
+            batch = claim_batch(current_app.config.get("OUTBOX_BATCH_SIZE", 20))
+            if not batch:
+                return total
+            total += send_batch(connection, batch)
+    finally:
+        close_quietly(connection)
+
+
+class OutboxSender:
+    """ワーカープロセスごとに1本の送信スレッド"""
+
+    def __init__(self):
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """送信スレッドを起動し（起動済みなら何もしない）、すぐにキューを確認させる"""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, args=(app,), name="outbox-sender", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self, app):
+        with app.app_context():
+            connection = mail.get_connection()
+            last_sent = None
+            while True:
+                self._wake.wait(app.config.get("OUTBOX_POLL_INTERVAL", 5))
+                self._wake.clear()
+                try:
+                    while True:
+                        batch = claim_batch(app.config.get("OUTBOX_BATCH_SIZE", 20))
+                        if not batch:
+                            break
+                        send_batch(connection, batch)
+                        last_sent = datetime.utcnow()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning(f"Outbox sender error: {e}")
+                finally:
+                    db.session.remove()
+
+                if last_sent and datetime.utcnow() - last_sent > IDLE_DISCONNECT:
+                    close_quietly(connection)
+                    last_sent = None
+
+
+outbox_sender = OutboxSender()
@@ -0,0 +1,106 @@
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import bcrypt
+from flask import current_app
+
+# --- パスワードのハッシュ化・照合 ---
+# bcrypt は1回あたり数百ミリ秒CPUを占有するため、リクエストのスレッドでは実行せず
+# ワーカーごとのプロセスプールに渡す。実行中＋待ち行列の件数に上限を設け、
+# 上限に達した場合は待たずに PasswordPoolBusy を送出する（APIは 503 を返す）。
+#
+# 設定（create_app で環境変数から読み込む）:
+#   BCRYPT_LOG_ROUNDS    : 新しく作るハッシュのコスト（既定 12）
+#   PASSWORD_POOL_WORKERS: プロセス数（既定 CPU数、0 ならリクエストのスレッドで直接実行）
+#   PASSWORD_QUEUE_LIMIT : 実行中以外に待たせる最大件数（既定 プロセス数 × 4）
+#   PASSWORD_TIMEOUT     : 1件あたりの最大待ち時間（秒、既定 10）
+
+_BCRYPT_HASH = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+
+class PasswordPoolBusy(Exception):
+    """パスワード処理の待ち行列が上限に達している"""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(password, password_hash):
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+    except ValueError:
+        # 壊れたハッシュや 72バイトを超えるパスワード
+        return False
+
+
+def hash_rounds(password_hash):
+    """ハッシュに記録されたコスト（不明なら None）"""
+    match = _BCRYPT_HASH.match(password_hash or "")
+    return int(match.group(1)) if match else None
+
+
+class PasswordPool:
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+
+    def _ensure_executor(self, workers, queue_limit):
+        # gunicorn の fork 後に親プロセスのプールを引き継がないよう、プロセスごとに作る
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(workers + queue_limit)
+            return self._executor, self._slots
+
+    def run(self, fn, *args):
+        config = current_app.config
+        workers = config.get("PASSWORD_POOL_WORKERS", os.cpu_count() or 1)
+        if workers <= 0:
+            return fn(*args)
+        queue_limit = config.get("PASSWORD_QUEUE_LIMIT")
+        if queue_limit is None:
+            queue_limit = workers * 4
+
+        executor, slots = self._ensure_executor(workers, queue_limit)
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordPoolBusy()
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        self.submitted += 1
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=config.get("PASSWORD_TIMEOUT", 10))
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordPoolBusy()
+
+    def stats(self):
+        return {"pid": self._pid, "submitted": self.submitted, "rejected": self.rejected}
+
+
+password_pool = PasswordPool()
+
+
+def hash_password(password):
+    return password_pool.run(_hash, password, current_app.config.get("BCRYPT_LOG_ROUNDS", 12))
+
+
+def check_password(password, password_hash):
+    return password_pool.run(_check, password, password_hash)
+
+
+def needs_rehash(password_hash):
+    """保存されているハッシュのコストが設定値と異なるか"""
+    return hash_rounds(password_hash) != current_app.config.get("BCRYPT_LOG_ROUNDS", 12)
@@ -1,8 +1,8 @@
 from flask import Blueprint, request, jsonify, current_app
 from .models import User
-from . import db, limiter
+from . import db, limiter, cache
 import os
-from flask_mailman import EmailMessage
+from .outbox import enqueue_email, wake_outbox
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
 
 pw_reset_bp = Blueprint('pw_reset', __name__, url_prefix='/api')
@@ -29,16 +29,19 @@ def forgot_password():
     frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
     reset_url = f"{frontend_url}/reset-password/{token}"
 
+    # 送信は outbox のバックグラウンドスレッドが行う（SMTPの応答を待たずに返す）
     try:
-        msg = EmailMessage(
+        enqueue_email(
+            to=[email],
             subject="パスワードリセットのご案内",
             body=f"以下のリンクからパスワードを再設定してください:\n\n{reset_url}\n\n※このリンクは1時間有効です。",
-            to=[email]
         )
-        msg.send()
+        db.session.commit()
     except Exception as e:
-        print(f"Error sending email: {e}")
+        db.session.rollback()
+        print(f"Error queueing email: {e}")
         return jsonify({"message": "Failed to send email"}), 500
+    wake_outbox()
 
     return jsonify({"message": "Password reset email sent"}), 200
 
@@ -66,5 +69,6 @@ def reset_password():
 
     user.set_password(new_password)
     db.session.commit()
+    cache.bump_version(cache.USERS)
 
     return jsonify({"message": "Password has been reset successfully", "email": email}), 200
\ No newline at end of file
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+import time
+import jwt as pyjwt
+from flask import current_app, request
+from flask_limiter.util import get_remote_address
+from limits.storage import Storage
+
+# --- レート制限のカウンタ保存先 ---
+# memory:// では gunicorn のワーカーごとにカウンタが分かれ、制限値がワーカー数倍に緩むため、
+# 同じホストのワーカー間で共有できる SQLite（WALモード）のファイルにカウンタを置く。
+#   RATELIMIT_STORAGE_URI=sqlite:///instance/ratelimit.db（相対パス） / sqlite:////var/run/ratelimit.db（絶対パス）
+# 対応する戦略は Flask-Limiter 既定の fixed-window のみ。
+
+# 期限切れのカウンタを掃除する間隔（incr の回数）
+PURGE_INTERVAL = 1000
+
+
+class SQLiteStorage(Storage):
+    """limits のストレージ実装。1回の加算は1トランザクション（UPSERT + SELECT）で完結する"""
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri[len("sqlite:///"):] if uri.startswith("sqlite:///") else uri[len("sqlite://"):]
+        self.timeout = float(options.get("timeout", 5))
+        self._local = threading.local()
+        self._incr_count = 0
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ratelimit_counters ("
+                " key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connect(self):
+        """スレッド・プロセスごとの接続（fork 後は親の接続を使わない）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO ratelimit_counters (key, value, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET"
+                "  value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END,"
+                "  expires_at = CASE WHEN expires_at <= ? OR ? THEN excluded.expires_at ELSE expires_at END",
+                (key, amount, now + expiry, now, now, bool(elastic_expiry)),
+            )
+            value = conn.execute("SELECT value FROM ratelimit_counters WHERE key = ?", (key,)).fetchone()[0]
+
+            self._incr_count += 1
+            if self._incr_count % PURGE_INTERVAL == 0:
+                conn.execute("DELETE FROM ratelimit_counters WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM ratelimit_counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connect().execute(
+            "SELECT expires_at FROM ratelimit_counters WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connect().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connect().execute("DELETE FROM ratelimit_counters").rowcount
+
+    def clear(self, key):
+        self._connect().execute("DELETE FROM ratelimit_counters WHERE key = ?", (key,))
+
+
+def rate_limit_key():
+    """
+    レート制限のキー。RATELIMIT_KEY_BY_USER が有効なら、有効なJWTを持つリクエストはユーザーID単位で数える
+    （同じNATの利用者が制限を共有しない / 1人が複数のIPから制限を回避できない）
+    """
+    if current_app.config.get("RATELIMIT_KEY_BY_USER"):
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            try:
+                data = pyjwt.decode(auth[7:], current_app.config["SECRET_KEY"], algorithms=["HS256"])
+                return f"user:{data['user_id']}"
+            except (pyjwt.InvalidTokenError, KeyError):
+                pass
+    return get_remote_address()
@@ -0,0 +1,305 @@
+import re
+import unicodedata
+from collections import defaultdict
+from . import db, cache
+from .models import Festivals
+
+# 検索対象のフィールドとスコアの重み
+SEARCH_FIELDS = {'name': 3.0, 'name_kana': 3.0, 'location': 2.0, 'description': 1.0}
+# 2文字以上のクエリで、この割合以上のN-gramが一致したお祭りを候補にする
+MIN_GRAM_COVERAGE = 0.6
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(text):
+    """
+    検索用の正規化。全角英数・半角カナを NFKC で揃え、カタカナをひらがなに、英字を小文字にする。
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).lower()
+    # ァ(U+30A1)〜ヶ(U+30F6) をひらがなへ
+    text = ''.join(chr(ord(ch) - 0x60) if 'ァ' <= ch <= 'ヶ' else ch for ch in text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def ngrams(text):
+    """1-gram と 2-gram の集合（空白をまたぐ N-gram は作らない）"""
+    grams = set()
+    for word in text.split(' '):
+        grams.update(word)
+        grams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+def query_grams(text):
+    """クエリ側は 2文字以上なら 2-gram のみ、1文字なら 1-gram で引く"""
+    grams = set()
+    for word in text.split(' '):
+        if len(word) == 1:
+            grams.add(word)
+        else:
+            grams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+class NgramIndex:
+    """
+    文字N-gramの転置インデックス。
+    お祭り単位で追加・削除できるよう、各ドキュメントの N-gram と正規化済みテキストも保持する。
+    検索中のスレッドがあるインデックスは変更せず、copy() に追加・削除してから差し替える。
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(set)  # gram -> {doc_id}
+        self.docs = {}  # doc_id -> (正規化済みフィールド, N-gram集合, 表示用データ)
+        self._shared = set()  # 他のインデックスと共有している postings の集合（変更前に複製する）
+
+    def copy(self):
+        """postings の集合を共有するコピー（どちらも共有中の集合は変更時に複製するため、互いに影響しない）"""
+        other = NgramIndex()
+        other.postings = defaultdict(set, self.postings)
+        other.docs = dict(self.docs)
+        self._shared = set(self.postings)
+        other._shared = set(self.postings)
+        return other
+
+    def _own(self, gram):
+        """変更してよい gram の集合"""
+        if gram in self._shared:
+            self._shared.discard(gram)
+            self.postings[gram] = set(self.postings[gram])
+        return self.postings[gram]
+
+    def add(self, doc_id, fields, summary):
+        """
+        :param fields: {フィールド名: テキスト}
+        :param summary: 検索結果として返す辞書
+        """
+        self.remove(doc_id)
+        normalized = {name: normalize(fields.get(name)) for name in SEARCH_FIELDS}
+        grams = set()
+        for value in normalized.values():
+            grams |= ngrams(value)
+        for gram in grams:
+            self._own(gram).add(doc_id)
+        self.docs[doc_id] = (normalized, grams, summary)
+
+    def remove(self, doc_id):
+        entry = self.docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for gram in entry[1]:
+            if gram in self.postings:
+                ids = self._own(gram)
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def _score(self, query, normalized, coverage):
+        """一致の質で点数を付ける（完全一致 > 前方一致 > 部分一致 > N-gramの一部一致）"""
+        score = 0.0
+        for name, weight in SEARCH_FIELDS.items():
+            value = normalized[name]
+            if not value:
+                continue
+            if value == query:
+                score += weight * 4
+            elif value.startswith(query):
+                score += weight * 3
+            elif query in value:
+                score += weight * 2
+            elif all(word in value for word in query.split(' ')):
+                score += weight * 1.5
+        return score + coverage
+
+    def search(self, text, limit=20):
+        """
+        :return: [(score, summary), ...] をスコアの高い順に最大 limit 件
+        """
+        query = normalize(text)
+        grams = query_grams(query)
+        if not grams:
+            return []
+
+        hits = defaultdict(int)
+        for gram in grams:
+            for doc_id in self.postings.get(gram, ()):
+                hits[doc_id] += 1
+
+        required = len(grams) if len(grams) == 1 else max(1, int(len(grams) * MIN_GRAM_COVERAGE + 0.999))
+        results = []
+        for doc_id, count in hits.items():
+            if count < required:
+                continue
+            normalized, _, summary = self.docs[doc_id]
+            results.append((self._score(query, normalized, count / len(grams)), doc_id, summary))
+
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return [(score, summary) for score, _, summary in results[:limit]]
+
+
+def festival_search_fields(festival):
+    return {name: getattr(festival, name) for name in SEARCH_FIELDS}
+
+
+def festival_summary(festival):
+    return {
+        'id': festival.id,
+        'name': festival.name,
+        'date': festival.date.strftime('%Y-%m-%d') if festival.date else None,
+        'location': festival.location,
+    }
+
+
+class FestivalSearchIndex(cache.VersionedCache):
+    """お祭りの名前・場所・説明文の検索インデックス"""
+
+    def build(self):
+        index = NgramIndex()
+        rows = db.session.query(
+            Festivals.id, Festivals.name, Festivals.name_kana, Festivals.date, Festivals.location, Festivals.description,
+        ).all()
+        for row in rows:
+            index.add(row.id, festival_search_fields(row), festival_summary(row))
+        return index
+
+
+festival_search_index = FestivalSearchIndex('festival_search_index', (cache.FESTIVALS,))
+
+
+# --- 入力補完 ---
+
+class _TrieNode:
+    __slots__ = ('children', 'doc_ids', 'top', 'owner')
+
+    def __init__(self, owner, children=None, doc_ids=None):
+        self.children = children if children is not None else {}
+        self.doc_ids = doc_ids if doc_ids is not None else set()  # このノードで終わるキーを持つドキュメント
+        self.top = None  # 部分木の上位候補（None は再計算が必要）
+        self.owner = owner  # このノードを変更してよいトライ木
+
+
+class PrefixTrie:
+    """
+    前方一致の入力補完用トライ木。
+    各ノードに部分木の上位 TOP_K 件をキャッシュしておき、検索は接頭辞の長さ分たどるだけで済ませる。
+    追加・削除時はキーの経路上のキャッシュだけを捨て、compute_top() で子ノードの上位候補から作り直す。
+    copy() は全ノードを共有し、追加・削除ではキーの経路上のノードだけを複製する（検索中の元の木は変わらない）。
+    """
+
+    TOP_K = 10
+
+    def __init__(self):
+        self._token = object()
+        self.root = _TrieNode(self._token)
+        self.docs = {}  # doc_id -> (キーのリスト, 並び順, 表示用データ)
+
+    def copy(self):
+        other = PrefixTrie()
+        other.root = self.root
+        other.docs = dict(self.docs)
+        # 以降はどちらの木も共有中のノードを変更せずに複製する
+        self._token = object()
+        return other
+
+    def _own(self, node):
+        """変更してよいノード（他の木と共有しているノードは複製する）"""
+        if node.owner is self._token:
+            return node
+        return _TrieNode(self._token, dict(node.children), set(node.doc_ids))
+
+    def _own_path(self, key):
+        """キーの経路上のノードを複製して付け替え、根からのノードのリストを返す"""
+        self.root = self._own(self.root)
+        path = [self.root]
+        for ch in key:
+            parent = path[-1]
+            child = parent.children.get(ch)
+            child = self._own(child) if child is not None else _TrieNode(self._token)
+            parent.children[ch] = child
+            path.append(child)
+        for node in path:
+            node.top = None
+        return path
+
+    def add(self, doc_id, keys, rank, summary):
+        """
+        :param keys: 正規化済みのキー（名前と読み仮名など）
+        :param rank: 小さいほど上位に表示する並び順のキー
+        """
+        self.remove(doc_id)
+        keys = sorted({key for key in keys if key})
+        self.docs[doc_id] = (keys, rank, summary)
+        for key in keys:
+            self._own_path(key)[-1].doc_ids.add(doc_id)
+
+    def remove(self, doc_id):
+        entry = self.docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for key in entry[0]:
+            path = self._own_path(key)
+            path[-1].doc_ids.discard(doc_id)
+            # 空になった枝を刈り込む
+            for depth in range(len(key), 0, -1):
+                node = path[depth]
+                if node.doc_ids or node.children:
+                    break
+                del path[depth - 1].children[key[depth - 1]]
+
+    def _top(self, node):
+        if node.top is None:
+            candidates = set(node.doc_ids)
+            for child in node.children.values():
+                candidates.update(self._top(child))
+            node.top = sorted(candidates, key=lambda doc_id: (self.docs[doc_id][1], doc_id))[:self.TOP_K]
+        return node.top
+
+    def compute_top(self):
+        """上位候補が捨てられたノードを作り直す（追加・削除の後、検索に使う前に呼ぶ）"""
+        self._top(self.root)
+
+    def suggest(self, prefix, limit=TOP_K):
+        """正規化済みの接頭辞に一致する候補を上位から最大 limit 件返す（compute_top() 済みの木で呼ぶ）"""
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return [self.docs[doc_id][2] for doc_id in node.top[:limit]]
+
+
+def festival_suggest_keys(festival):
+    return [normalize(festival.name), normalize(festival.name_kana)]
+
+
+def festival_rank(festival):
+    """来場者数の多い順、同数なら名前順"""
+    try:
+        attendance = int(festival.attendance or 0)
+    except (TypeError, ValueError):
+        attendance = 0
+    return (-attendance, festival.name or '')
+
+
+class FestivalSuggestIndex(cache.VersionedCache):
+    """お祭り名と読み仮名の入力補完トライ木"""
+
+    def build(self):
+        trie = PrefixTrie()
+        rows = db.session.query(
+            Festivals.id, Festivals.name, Festivals.name_kana, Festivals.date, Festivals.location, Festivals.attendance,
+        ).all()
+        for row in rows:
+            trie.add(row.id, festival_suggest_keys(row), festival_rank(row), festival_summary(row))
+        self.finish(trie)
+        return trie
+
+    def finish(self, trie):
+        # 全ノードの上位候補を公開前に計算しておく（検索中にノードを書き換えない）
+        trie.compute_top()
+
+
+festival_suggest_index = FestivalSuggestIndex('festival_suggest_index', (cache.FESTIVALS,))
@@ -0,0 +1,315 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+import requests
+from flask import current_app, redirect, request
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+# --- アップロードの保存先 ---
+# 写真のファイルは UPLOAD_STORAGE で選んだバックエンドに置く。どちらも同じ操作を持つ:
+#   staging_dir()   : 受信・縮小版の作成に使うローカルのディレクトリ
+#   publish(name)   : staging_dir() に置いたファイルを公開する（既に同じ名前があれば何もしない。
+#                     current_app に触れないため、スレッドプールからも呼べる）
+#   delete(name)    : 削除する（存在しなくてもよい）
+#   iter_files()    : 保存されているファイルを (name, size, mtime) で順に返す
+#   send(name)      : GET /api/uploads/<name> のレスポンス
+#
+# 'local'（既定）: app/static/uploads に置き、Flask（または X-Accel-Redirect / X-Sendfile でプロキシ）から配信する。
+#                  staging_dir() が保存先そのものなので publish は何もしない。
+# 's3'          : S3 互換のオブジェクトストレージ（AWS S3 / MinIO など）に置く。署名は SigV4 を requests で行い、
+#                  配信は期限付きの署名URLへのリダイレクトにして、画像のバイト列はワーカーを通さない。
+#                  複数台のアプリサーバーで同じ写真を扱える。
+#
+# ファイル名は内容のハッシュで、同じ名前の中身が変わることはないため、どちらも immutable の長期キャッシュを付ける。
+#
+# 設定（create_app で環境変数から読み込む）:
+#   UPLOAD_STORAGE         : 'local' / 's3'（既定 'local'）
+#   UPLOADS_SENDFILE       : local のみ。'' / 'x-accel' / 'x-sendfile'（既定 ''）
+#   UPLOADS_ACCEL_PREFIX   : local のみ。X-Accel-Redirect の location（既定 /_uploads/）
+#   UPLOADS_MAX_AGE        : Cache-Control の max-age（秒、既定 1年）
+#   S3_ENDPOINT_URL        : 例 https://s3.ap-northeast-1.amazonaws.com / http://minio:9000
+#   S3_PUBLIC_ENDPOINT_URL : ブラウザから見たエンドポイント（署名URL用。既定 S3_ENDPOINT_URL）
+#   S3_BUCKET / S3_REGION（既定 us-east-1） / S3_ACCESS_KEY_ID / S3_SECRET_ACCESS_KEY
+#   S3_PREFIX              : オブジェクトキーの前置き（既定 'uploads/'）
+#   S3_PRESIGN_EXPIRES     : 署名URLの有効期間（秒、既定・上限 7日）
+
+DEFAULT_MAX_AGE = 365 * 24 * 60 * 60
+MAX_PRESIGN_EXPIRES = 7 * 24 * 60 * 60
+S3_NAMESPACE = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+S3_TIMEOUT = 30
+
+
+class StorageError(Exception):
+    """保存先への操作が失敗した"""
+
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _set_cache_headers(response, max_age):
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True
+    return response
+
+
+class LocalStorage:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def staging_dir(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    def publish(self, name):
+        pass
+
+    def delete(self, name):
+        path = os.path.join(self.directory, os.path.basename(name))
+        if os.path.exists(path):
+            os.remove(path)
+
+    def iter_files(self):
+        if not os.path.isdir(self.directory):
+            return
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # 受信途中の一時ファイル（.upload-*.tmp）は含め、それ以外の隠しファイルは除く
+                if not entry.is_file() or (entry.name.startswith('.') and not entry.name.startswith('.upload-')):
+                    continue
+                stat = entry.stat()
+                yield entry.name, stat.st_size, stat.st_mtime
+
+    def send(self, name):
+        """
+        ETag はファイル名そのものにしてワーカーやデプロイ（ファイルのコピーで mtime が変わる）をまたいでも同じ値にし、
+        条件付きリクエストと Range リクエストには send_file の conditional 処理で応じる。
+        UPLOADS_SENDFILE を設定すると、ワーカーはヘッダーだけを返し、中身（と ETag・Range）はリバースプロキシに任せる
+        （x-accel なら nginx に location /_uploads/ { internal; alias /app/app/static/uploads/; } が必要）
+        """
+        config = current_app.config
+        path = safe_join(self.directory, name)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+
+        max_age = config.get('UPLOADS_MAX_AGE', DEFAULT_MAX_AGE)
+        mode = config.get('UPLOADS_SENDFILE') or ''
+        if mode in ('x-accel', 'x-sendfile'):
+            response = current_app.response_class(mimetype=content_type(name))
+            if mode == 'x-accel':
+                response.headers['X-Accel-Redirect'] = config.get('UPLOADS_ACCEL_PREFIX', '/_uploads/').rstrip('/') + '/' + name
+            else:
+                response.headers['X-Sendfile'] = os.path.abspath(path)
+            return _set_cache_headers(response, max_age)
+
+        response = send_file(
+            path, request.environ, etag=name, max_age=max_age, response_class=current_app.response_class,
+        )
+        return _set_cache_headers(response, max_age)
+
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+def _quote(value, safe='-_.~'):
+    return quote(str(value), safe=safe)
+
+
+class S3Storage:
+    """S3 互換ストレージ（パス形式 <endpoint>/<bucket>/<key> でアクセスする）"""
+
+    def __init__(self, endpoint_url, bucket, region, access_key, secret_key, staging_dir,
+                 prefix='uploads/', public_endpoint_url=None, presign_expires=MAX_PRESIGN_EXPIRES,
+                 max_age=DEFAULT_MAX_AGE):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.public_endpoint_url = (public_endpoint_url or endpoint_url).rstrip('/')
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix
+        self.presign_expires = min(presign_expires, MAX_PRESIGN_EXPIRES)
+        # オブジェクトに付ける Cache-Control（S3 が GET の応答にそのまま返す）
+        self.max_age = max_age
+        self._staging_dir = staging_dir
+        # 接続を使い回すため、スレッドごとに requests.Session を持つ
+        self._local = threading.local()
+
+    # --- SigV4 ---
+
+    def _signing_key(self, date):
+        key = _hmac(('AWS4' + self.secret_key).encode('utf-8'), date)
+        for part in (self.region, 's3', 'aws4_request'):
+            key = _hmac(key, part)
+        return key
+
+    def _path(self, name=''):
+        return f"/{self.bucket}/" + _quote(self.prefix + name, safe='-_.~/') if name else f"/{self.bucket}"
+
+    def _signature(self, method, path, query, headers, payload_hash, amz_date):
+        """
+        :param query: {name: value}（署名・URL の両方に同じ並びで使う）
+        :param headers: 署名するヘッダー（小文字の名前）
+        :return: (scope, signed_headers, signature)
+        """
+        canonical_query = '&'.join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items()))
+        signed_headers = ';'.join(sorted(headers))
+        canonical_headers = ''.join(f"{k}:{str(headers[k]).strip()}\n" for k in sorted(headers))
+        canonical_request = '\n'.join([method, path, canonical_query, canonical_headers, signed_headers, payload_hash])
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+        ])
+        signature = hmac.new(self._signing_key(amz_date[:8]), string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        return scope, signed_headers, signature
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _request(self, method, name='', query=None, body=b'', payload_hash=None, headers=None):
+        query = query or {}
+        path = self._path(name)
+        amz_date = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        payload_hash = payload_hash or hashlib.sha256(body).hexdigest()
+        signed = {
+            'host': urlsplit(self.endpoint_url).netloc,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+            **{k.lower(): v for k, v in (headers or {}).items()},
+        }
+        scope, signed_headers, signature = self._signature(method, path, query, signed, payload_hash, amz_date)
+        signed['authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        url = self.endpoint_url + path
+        if query:
+            url += '?' + '&'.join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items()))
+        try:
+            return self._session().request(method, url, data=body, headers=signed, timeout=S3_TIMEOUT)
+        except requests.RequestException as e:
+            raise StorageError(f"{method} {path}: {e}") from e
+
+    def _check(self, response, *ok):
+        if response.status_code not in (200, 204, *ok):
+            raise StorageError(f"{response.request.method} {response.url}: {response.status_code} {response.text[:200]}")
+        return response
+
+    def presigned_url(self, name, now=None):
+        """
+        ダウンロード用の署名URL。署名時刻を有効期間の半分の区切りに揃えるため、同じ区切りの間は
+        どのワーカーでも同じURLになり、ブラウザのキャッシュが効く（残りの有効期間は常に半分以上ある）
+        """
+        window = self.presign_expires // 2
+        signed_at = int(now if now is not None else time.time()) // window * window
+        amz_date = datetime.fromtimestamp(signed_at, timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        path = self._path(name)
+        query = {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f"{self.access_key}/{amz_date[:8]}/{self.region}/s3/aws4_request",
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(self.presign_expires),
+            'X-Amz-SignedHeaders': 'host',
+        }
+        headers = {'host': urlsplit(self.public_endpoint_url).netloc}
+        _, _, signature = self._signature('GET', path, query, headers, 'UNSIGNED-PAYLOAD', amz_date)
+        query['X-Amz-Signature'] = signature
+        url = self.public_endpoint_url + path + '?' + '&'.join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items()))
+        return url, signed_at + window
+
+    # --- 保存先の操作 ---
+
+    def staging_dir(self):
+        os.makedirs(self._staging_dir, exist_ok=True)
+        return self._staging_dir
+
+    def exists(self, name):
+        response = self._request('HEAD', name)
+        if response.status_code == 404:
+            return False
+        self._check(response)
+        return True
+
+    def publish(self, name):
+        """staging_dir() のファイルをアップロードしてローカルから消す（同じ名前のオブジェクトがあれば送らない）"""
+        path = os.path.join(self._staging_dir, name)
+        if not os.path.exists(path):
+            return
+        if not self.exists(name):
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    digest.update(chunk)
+            with open(path, 'rb') as f:
+                self._check(self._request('PUT', name, body=f, payload_hash=digest.hexdigest(), headers={
+                    'Content-Type': content_type(name),
+                    'Cache-Control': f"public, max-age={self.max_age}, immutable",
+                }))
+        os.remove(path)
+
+    def delete(self, name):
+        self._check(self._request('DELETE', name), 404)
+
+    def iter_files(self):
+        """ListObjectsV2 を1000件ずつ読みながら返す"""
+        token = None
+        while True:
+            query = {'list-type': '2', 'prefix': self.prefix, 'max-keys': '1000'}
+            if token:
+                query['continuation-token'] = token
+            root = ET.fromstring(self._check(self._request('GET', query=query)).content)
+            for item in root.iter(f'{S3_NAMESPACE}Contents'):
+                key = item.findtext(f'{S3_NAMESPACE}Key')
+                modified = datetime.fromisoformat(item.findtext(f'{S3_NAMESPACE}LastModified').replace('Z', '+00:00'))
+                yield key[len(self.prefix):], int(item.findtext(f'{S3_NAMESPACE}Size')), modified.timestamp()
+            if root.findtext(f'{S3_NAMESPACE}IsTruncated') != 'true':
+                return
+            token = root.findtext(f'{S3_NAMESPACE}NextContinuationToken')
+
+    def send(self, name):
+        """署名URLへのリダイレクト。リダイレクト自体も署名の区切りが変わるまでキャッシュさせる"""
+        if '/' in name or name.startswith('.'):
+            raise NotFound()
+        url, cacheable_until = self.presigned_url(name)
+        response = redirect(url, code=302)
+        return _set_cache_headers(response, max(int(cacheable_until - time.time()), 0))
+
+
+def create_storage(app):
+    config = app.config
+    if config.get('UPLOAD_STORAGE', 'local') == 's3':
+        return S3Storage(
+            endpoint_url=config.get('S3_ENDPOINT_URL') or f"https://s3.{config.get('S3_REGION', 'us-east-1')}.amazonaws.com",
+            bucket=config['S3_BUCKET'],
+            region=config.get('S3_REGION', 'us-east-1'),
+            access_key=config['S3_ACCESS_KEY_ID'],
+            secret_key=config['S3_SECRET_ACCESS_KEY'],
+            staging_dir=os.path.join(app.instance_path, 'upload-staging'),
+            prefix=config.get('S3_PREFIX', 'uploads/'),
+            public_endpoint_url=config.get('S3_PUBLIC_ENDPOINT_URL'),
+            presign_expires=config.get('S3_PRESIGN_EXPIRES', MAX_PRESIGN_EXPIRES),
+            max_age=config.get('UPLOADS_MAX_AGE', DEFAULT_MAX_AGE),
+        )
+    return LocalStorage(os.path.join(app.root_path, 'static', 'uploads'))
+
+
+def get_storage():
+    """現在のアプリの保存先（初回に UPLOAD_STORAGE から作る）"""
+    storage = current_app.extensions.get('upload_storage')
+    if storage is None:
+        storage = current_app.extensions['upload_storage'] = create_storage(current_app)
+    return storage
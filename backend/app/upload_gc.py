@@ -0,0 +1,162 @@
+import os
+import re
+import threading
+import time
+from flask import current_app
+from . import db
+from .models import FestivalPhoto, FestivalPhotoVariant, UploadBlob
+from .storage import LocalStorage, get_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows の開発環境ではワーカー間の排他なしで動作させる
+    fcntl = None
+
+# --- 使われていないアップロードの回収 ---
+# 以前のお祭り削除（ファイルを消していなかった）や commit に失敗したアップロード、途中で切れた受信の
+# 一時ファイル（.upload-*.tmp）などで、DB から参照されないファイルが保存先（app/storage.py）に残る。
+# 保存先のファイルを順に読み（ローカルは os.scandir、S3 は ListObjectsV2 を1000件ずつ）、GC_BATCH_SIZE 件ずつ
+# ファイル名の内容のハッシュで upload_blobs（主キー）に問い合わせて、参照数の残っていないファイルを削除する（一覧全体をメモリに載せない）。
+# 内容のハッシュ名で保存する前の写真（content_hash が None）のファイルは、実行の最初にその写真の行から参照先を1回だけ読む。
+# アップロード直後でまだ commit されていないファイルを消さないよう、更新から min_age 以内のファイルは残す。
+#
+# 設定（create_app で環境変数から読み込む）:
+#   UPLOAD_GC_MIN_AGE  : 回収対象にする最終更新からの経過時間（秒、既定 1時間）
+#   UPLOAD_GC_INTERVAL : ワーカー内で定期的に回収する間隔（秒、既定 0 = 定期実行しない）。
+#                        全ワーカーで1回だけ実行されるよう instance/upload_gc.lock で排他する
+
+GC_BATCH_SIZE = 500
+_HASH = re.compile(r'[0-9a-f]{64}')
+
+
+def _content_hash(filename):
+    """'<hash>.jpg' / '<hash>_thumb.webp' から hash の部分（内容のハッシュ名でなければ None）"""
+    prefix = filename.split('.', 1)[0].split('_', 1)[0]
+    return prefix if _HASH.fullmatch(prefix) else None
+
+
+def _legacy_referenced():
+    """内容のハッシュ名で保存する前の写真と、その縮小版が参照しているファイル名"""
+    legacy = FestivalPhoto.content_hash.is_(None)
+    urls = [url for (url,) in db.session.query(FestivalPhoto.image_url).filter(legacy)]
+    urls += [url for (url,) in db.session.query(FestivalPhotoVariant.image_url).join(FestivalPhoto).filter(legacy)]
+    return {url.rsplit('/', 1)[1] for url in urls}
+
+
+def _referenced(names, legacy):
+    """names のうち参照されているファイル名（参照数が残っている実体と縮小版、または legacy に含まれるもの）"""
+    live = {
+        content_hash for (content_hash,) in db.session.query(UploadBlob.content_hash).filter(
+            UploadBlob.content_hash.in_({_content_hash(name) for name in names} - {None}), UploadBlob.ref_count > 0,
+        )
+    }
+    return {name for name in names if _content_hash(name) in live or name in legacy}
+
+
+def collect_orphans(dry_run=False, min_age=None, on_orphan=None):
+    """
+    アップロードの保存先と DB を突き合わせ、参照されていないファイルを削除する
+    :param dry_run: True なら削除せずに対象を数えるだけ
+    :param min_age: 最終更新からこの秒数が経っていないファイルは残す（既定 UPLOAD_GC_MIN_AGE）
+    :param on_orphan: 対象のファイルごとに on_orphan(filename, size) を呼ぶ
+    :return: {'scanned', 'recent', 'orphaned', 'reclaimed_bytes', 'purged_blobs'}
+    """
+    if min_age is None:
+        min_age = current_app.config.get('UPLOAD_GC_MIN_AGE', 3600)
+    stats = {'scanned': 0, 'recent': 0, 'orphaned': 0, 'reclaimed_bytes': 0, 'purged_blobs': 0}
+    storage = get_storage()
+
+    # 参照数が 0 のまま残った実体（purge_blobs の前にプロセスが落ちた場合など）は行を消し、ファイルは下で回収する
+    if not dry_run:
+        stats['purged_blobs'] = UploadBlob.query.filter(UploadBlob.ref_count <= 0).delete(synchronize_session=False)
+        db.session.commit()
+
+    legacy = _legacy_referenced()
+
+    def sweep(batch):
+        referenced = _referenced([name for name, _ in batch], legacy)
+        for name, size in batch:
+            if name in referenced:
+                continue
+            stats['orphaned'] += 1
+            stats['reclaimed_bytes'] += size
+            if on_orphan:
+                on_orphan(name, size)
+            if not dry_run:
+                storage.delete(name)
+
+    cutoff = time.time() - min_age
+    batch = []
+    for name, size, mtime in storage.iter_files():
+        stats['scanned'] += 1
+        if mtime > cutoff:
+            stats['recent'] += 1
+            continue
+        batch.append((name, size))
+        if len(batch) >= GC_BATCH_SIZE:
+            sweep(batch)
+            batch = []
+    if batch:
+        sweep(batch)
+    db.session.rollback()
+
+    # ローカル以外の保存先では、受信・縮小版の作成に使う作業ディレクトリに残ったファイルも古いものから消す
+    if not isinstance(storage, LocalStorage):
+        staging = LocalStorage(storage.staging_dir())
+        for name, size, mtime in staging.iter_files():
+            if mtime > cutoff:
+                continue
+            stats['orphaned'] += 1
+            stats['reclaimed_bytes'] += size
+            if on_orphan:
+                on_orphan(name, size)
+            if not dry_run:
+                staging.delete(name)
+    return stats
+
+
+class UploadCollector:
+    """UPLOAD_GC_INTERVAL ごとに collect_orphans を実行するワーカー内のスレッド"""
+
+    def __init__(self):
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, args=(app,), name="upload-gc", daemon=True)
+                self._thread.start()
+
+    def _run(self, app):
+        interval = app.config.get('UPLOAD_GC_INTERVAL', 0)
+        lock_path = os.path.join(app.instance_path, 'upload_gc.lock')
+        while True:
+            time.sleep(interval)
+            with open(lock_path, 'a') as lock_file:
+                if fcntl:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # 他のワーカーが回収中
+                # ロックファイルの更新日時を前回の実行日時として使い、全ワーカーで interval に1回にする
+                if time.time() - os.path.getmtime(lock_path) < interval:
+                    continue
+                os.utime(lock_path)
+                with app.app_context():
+                    try:
+                        stats = collect_orphans()
+                        if stats['orphaned']:
+                            app.logger.info(
+                                f"Upload GC removed {stats['orphaned']} files ({stats['reclaimed_bytes']} bytes)"
+                            )
+                    except Exception as e:
+                        db.session.rollback()
+                        app.logger.warning(f"Upload GC error: {e}")
+                    finally:
+                        db.session.remove()
+
+
+upload_collector = UploadCollector()
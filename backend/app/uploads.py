@@ -0,0 +1,308 @@
+import hashlib
+import os
+import tempfile
+from flask import current_app, request
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from . import db, images
+from .models import UploadBlob
+from .storage import get_storage
+
+# ファイルの保存先（ローカル / S3 互換）と配信は app/storage.py
+
+
+def upload_url(filename):
+    return f"/api/uploads/{filename}"
+
+
+def send_upload(filename):
+    """GET /api/uploads/<filename> のレスポンス（ローカルなら配信、S3 なら署名URLへのリダイレクト）"""
+    return get_storage().send(filename)
+
+
+# --- ストリーミングでの受信 ---
+# request.files を使うと Werkzeug が本文全体を読み終えてからビューが動くため、写真のアップロードは
+# request.stream を MultipartDecoder で少しずつ読み、ファイルの部分を保存先の作業ディレクトリ
+# （storage.staging_dir()）の一時ファイルへ直接書き出す（書き出しながら SHA-256 も計算する）。上限は読み終わる前に確かめる:
+#   - Content-Length が request.max_content_length を超える本文は読まずに 413
+#   - ファイルの先頭バイトが対応する画像形式でなければ、その時点で 415
+#   - 1ファイルが PHOTO_MAX_FILE_SIZE を超えた時点で 413
+# 拡張子はファイル名ではなく先頭バイトから判定した形式で決める。受信を終えたファイルからはメタデータを取り除く
+# （images.strip_metadata）。
+#
+# 設定（create_app で環境変数から読み込む）:
+#   PHOTO_MAX_FILE_SIZE : 写真1枚の上限（バイト、既定 20MB）
+#   MAX_CONTENT_LENGTH  : 写真以外のリクエスト本文の上限（Flask 標準の設定、既定 16MB）
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_FILE_SIZE = 20 * 1024 * 1024
+# multipart の境界やヘッダー、ファイル以外のフィールドのための余白
+FORM_OVERHEAD = 64 * 1024
+# デコーダーが溜めておけるバイト数（1回に読む量より大きくする）と、ファイル以外に許す部分の数
+DECODER_BUFFER_SIZE = 4 * CHUNK_SIZE
+MAX_EXTRA_PARTS = 16
+
+# 先頭バイト → 保存時の拡張子
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+]
+SNIFF_LENGTH = 12
+
+
+class UploadRejected(Exception):
+    """アップロードを受け付けない（status は返すべき HTTP ステータス）"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.0f}MB"
+    return f"{size / 1024:.0f}KB"
+
+
+def sniff_image_ext(head):
+    """ファイル先頭のバイト列から画像形式の拡張子を判定する（対応外なら None）"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+class ReceivedFile:
+    """受信中・受信済みのファイル（アップロード先ディレクトリの一時ファイル）"""
+
+    def __init__(self, directory, filename, max_size):
+        self.filename = filename
+        self.max_size = max_size
+        self.size = 0
+        self.ext = None
+        self.content_hash = None
+        # skip_invalid で受信した場合、受け付けなかった理由（UploadRejected）
+        self.error = None
+        self._head = b''
+        self._digest = hashlib.sha256()
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.tmp')
+        self._out = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadRejected(f'ファイルサイズは {format_size(self.max_size)} 以下にしてください', 413)
+        if len(self._head) < SNIFF_LENGTH:
+            self._head += data[:SNIFF_LENGTH - len(self._head)]
+            if len(self._head) >= SNIFF_LENGTH:
+                self._check_type()
+        self._digest.update(data)
+        self._out.write(data)
+
+    def _check_type(self):
+        self.ext = sniff_image_ext(self._head)
+        if self.ext is None:
+            raise UploadRejected('JPEG / PNG / GIF / WebP の画像を選択してください', 415)
+
+    def finish(self):
+        self._out.close()
+        if self.ext is None:
+            self._check_type()
+        self.content_hash = self._digest.hexdigest()
+        # 元画像はそのまま配信するため、EXIF（位置情報など）を取り除いておく（ハッシュは受信した内容のまま）
+        try:
+            self.size = images.strip_metadata(self.temp_path, self.ext)
+        except ValueError:
+            raise UploadRejected('画像を読み込めませんでした', 415)
+
+    def discard(self):
+        self._out.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def receive_files(field_name, max_files=1, max_request_size=None, skip_invalid=False):
+    """
+    multipart/form-data の本文を読みながら field_name のファイルを一時ファイルに受信する
+    （request.files・request.form には触れないこと。ファイル名が空の部分とその他のフィールドは読み捨てる）
+    :param max_request_size: 本文全体の上限（既定は PHOTO_MAX_FILE_SIZE × max_files + 余白）
+    :param skip_invalid: True なら形式・サイズが上限外のファイルは error に理由を入れて読み飛ばし、続きを受信する
+    :return: ReceivedFile のリスト（受信順）
+    :raises UploadRejected: 本文やファイルが上限外の場合（受信済みの一時ファイルは削除する）
+    """
+    max_size = current_app.config.get('PHOTO_MAX_FILE_SIZE', DEFAULT_MAX_FILE_SIZE)
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        raise UploadRejected('multipart/form-data で送信してください', 400)
+
+    directory = get_storage().staging_dir()
+    # request.stream を参照する前に設定する（Content-Length が超えていれば読まずに 413 になる）
+    request.max_content_length = max_request_size or max_size * max_files + FORM_OVERHEAD
+    decoder = MultipartDecoder(
+        options['boundary'].encode(), max_form_memory_size=DECODER_BUFFER_SIZE, max_parts=max_files + MAX_EXTRA_PARTS,
+    )
+    received = []
+    current = None
+    try:
+        stream = request.stream
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File) and event.name == field_name and event.filename:
+                    if len(received) >= max_files:
+                        raise UploadRejected(f'一度にアップロードできるのは {max_files} 枚までです', 400)
+                    current = ReceivedFile(directory, event.filename, max_size)
+                    received.append(current)
+                elif isinstance(event, (File, Field)):
+                    current = None
+                elif isinstance(event, Data) and current is not None:
+                    try:
+                        current.write(event.data)
+                        if not event.more_data:
+                            current.finish()
+                            current = None
+                    except UploadRejected as e:
+                        if not skip_invalid:
+                            raise
+                        current.discard()
+                        current.error = e
+                        current = None
+                event = decoder.next_event()
+            if not chunk or isinstance(event, Epilogue):
+                break
+        if current is not None:
+            raise UploadRejected('アップロードが途中で終了しました', 400)
+    except RequestEntityTooLarge:
+        for item in received:
+            item.discard()
+        raise UploadRejected(f'一度に送信できるのは {format_size(request.max_content_length)} までです', 413)
+    except ValueError:
+        # multipart の形式が壊れている・本文が途中で切れている
+        for item in received:
+            item.discard()
+        raise UploadRejected('アップロードの形式が正しくありません', 400)
+    except BaseException:
+        for item in received:
+            item.discard()
+        raise
+    return received
+
+
+# --- 内容のハッシュによる保存 ---
+# 受信した一時ファイルは、内容の SHA-256 から '<hash><拡張子>' の名前にして置き換える（os.replace で一度に移す）。
+# 同じ画像が再度アップロードされた場合は既存のファイル（縮小版 '<hash>_<size>.<ext>' を含む）を共有し、
+# upload_blobs.ref_count で参照している写真の数を数える。ファイルを消すのは参照がなくなったときだけ。
+#   store_upload   : 作業ディレクトリに置いて参照を1増やす（呼び出し元のトランザクション内）
+#   publish_files  : 元画像と縮小版を保存先に公開する（commit の前に呼ぶ）
+#   release_blob   : 参照を1減らす（呼び出し元のトランザクション内）
+#   purge_blobs    : commit 後に呼び、参照がなくなったファイルを削除する
+
+
+def store_upload(received):
+    """
+    受信したファイルを作業ディレクトリで内容のハッシュ名にし、参照数を1増やす
+    （縮小版を作った後に publish_files を呼び、呼び出し元で commit する）
+    :param received: receive_files で受信した ReceivedFile。既存の画像と同じ内容なら既存のファイル名を使う
+    :return: (content_hash, filename, created)。created は初めて保存された内容なら True
+    """
+    directory = get_storage().staging_dir()
+    content_hash = received.content_hash
+    created = False
+    try:
+        # ファイルより先に参照数を増やして行をロックする。purge_blobs が同じ実体を削除中なら
+        # その commit を待ってから 0 行となり、新しい実体として保存し直す
+        if _increment(content_hash):
+            filename = db.session.get(UploadBlob, content_hash, populate_existing=True).filename
+        else:
+            filename = f"{content_hash}{received.ext}"
+            try:
+                with db.session.begin_nested():
+                    db.session.add(UploadBlob(
+                        content_hash=content_hash, filename=filename, size=received.size, ref_count=1,
+                    ))
+                created = True
+            except IntegrityError:
+                # 別のワーカーが同時に同じ画像を保存した
+                _increment(content_hash)
+                filename = db.session.get(UploadBlob, content_hash, populate_existing=True).filename
+
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            received.discard()
+            # 回収（app/upload_gc.py）は更新から間もないファイルを消さないため、使い回すファイルも更新日時を新しくする
+            os.utime(path)
+        else:
+            os.replace(received.temp_path, path)
+    except BaseException:
+        received.discard()
+        raise
+    return content_hash, filename, created
+
+
+def _increment(content_hash):
+    """参照数を1増やす（行がなければ 0 を返す）"""
+    return UploadBlob.query.filter_by(content_hash=content_hash).update(
+        {UploadBlob.ref_count: UploadBlob.ref_count + 1}, synchronize_session=False
+    )
+
+
+def release_blob(content_hash):
+    """参照数を1減らす（呼び出し元で commit し、その後 purge_blobs を呼ぶ）"""
+    UploadBlob.query.filter_by(content_hash=content_hash).update(
+        {UploadBlob.ref_count: UploadBlob.ref_count - 1}, synchronize_session=False
+    )
+
+
+def blob_filenames(content_hash, filename):
+    """実体のファイルと、存在しうる縮小版のファイル名"""
+    return [filename] + [
+        f"{content_hash}_{size}.{ext}" for size in images.VARIANT_SIZES for ext in images.VARIANT_FORMATS
+    ]
+
+
+def publish_files(filenames, storage=None):
+    """
+    作業ディレクトリに置いたファイルを保存先に公開する（作業ディレクトリにないもの＝既存の共有ファイルは何もしない）
+    :param storage: スレッドプールから呼ぶ場合は呼び出し元で get_storage() を渡す
+    """
+    storage = storage or get_storage()
+    for filename in filenames:
+        storage.publish(os.path.basename(filename))
+
+
+def remove_files(filenames):
+    storage = get_storage()
+    for filename in filenames:
+        storage.delete(os.path.basename(filename))
+
+
+def purge_blobs(content_hashes):
+    """参照がなくなった実体の行とファイルを削除する（release_blob を commit した後に呼ぶ）"""
+    for content_hash in set(content_hashes):
+        blob = db.session.get(UploadBlob, content_hash, populate_existing=True)
+        if blob is None or blob.ref_count > 0:
+            continue
+        filename = blob.filename
+        # 確認後に同じ画像がアップロードされて参照が増えていれば消さない。
+        # 条件付き DELETE で行をロックしたままファイルを消し、その後に commit する
+        # （同じ画像の store_upload は参照数の UPDATE でこの commit を待ち、ファイルを置き直す）
+        deleted = UploadBlob.query.filter(
+            UploadBlob.content_hash == content_hash, UploadBlob.ref_count <= 0
+        ).delete(synchronize_session=False)
+        if deleted:
+            try:
+                remove_files(blob_filenames(content_hash, filename))
+            except Exception as e:
+                # 行は参照数 0 のまま残し、flask gc-uploads で回収する
+                db.session.rollback()
+                current_app.logger.warning(f"Failed to remove files of blob {content_hash}: {e}")
+                continue
+        db.session.commit()
@@ -0,0 +1,227 @@
+"""
+認証まわりのスループット計測
+
+ローカルの SQLite にユーザーを用意し、Flask のテストクライアントから次のリクエストを繰り返して
+1ワーカーあたりの requests/s と p50/p99 レイテンシを計測する。
+
+- パスワードログイン（/api/login）: bcrypt のコストごと
+- パスキーログイン（/api/login/options → /api/login/verify）: P-256 の鍵で署名したアサーションを送る
+- JWT 認証付きの読み取り（/api/account/data）: 認証ユーザーキャッシュの有無
+- OAuth ログイン（/api/auth/google, /api/auth/line）: 外部APIへの requests 呼び出しは固定の応答に差し替える
+
+CONCURRENCY のスレッド数でも同じリクエストを並行に送り、パスワード処理のプロセスプールの効果を見る。
+
+backendディレクトリから実行することを想定:
+    python benchmarks/bench_auth.py
+"""
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cbor2
+import jwt
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from flask import Flask
+from app import db
+from app.models import Passkey, User
+from app.passwords import _hash
+
+BCRYPT_COSTS = [4, 8, 10, 12]
+CONCURRENCY = [1, 4]
+# 1ケースあたりの計測時間（秒）と最低リクエスト数
+DURATION = 3.0
+MIN_REQUESTS = 20
+SECRET_KEY = "bench-secret-key-for-hs256-signing"
+ORIGIN = "http://localhost"
+CREDENTIAL_ID = base64.urlsafe_b64encode(b"bench-credential").decode().rstrip("=")
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def create_bench_app(tmp):
+    # instance 以下に書き出すファイルも一時ディレクトリに置く
+    app = Flask(__name__, instance_path=tmp)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}", SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECRET_KEY=SECRET_KEY,
+        GOOGLE_CLIENT_ID="bench", GOOGLE_CLIENT_SECRET="bench", GOOGLE_REDIRECT_URI="http://localhost/cb",
+        LINE_CHANNEL_ID="bench", LINE_CHANNEL_SECRET="bench", LINE_REDIRECT_URI="http://localhost/cb",
+        PASSWORD_POOL_WORKERS=os.cpu_count() or 1,
+    )
+    db.init_app(app)
+    from app.api_routes import api_bp
+    from app.oauth import oauth_bp
+    app.register_blueprint(api_bp)
+    app.register_blueprint(oauth_bp, url_prefix="/api/auth")
+    return app
+
+
+def seed(private_key):
+    db.create_all()
+    for cost in BCRYPT_COSTS:
+        db.session.add(User(userID=f"user{cost}", username=f"user{cost}", password_hash=_hash("password", cost)))
+    db.session.add(User(userID="google", username="Google User", email="google@example.com", google_user_id="g-1"))
+    db.session.add(User(userID="line", username="LINE User", email="line@example.com", line_user_id="l-1"))
+    passkey_user = User(userID="passkey", username="passkey")
+    db.session.add(passkey_user)
+    db.session.flush()
+
+    numbers = private_key.public_key().public_numbers()
+    cose_key = {1: 2, 3: -7, -1: 1, -2: numbers.x.to_bytes(32, "big"), -3: numbers.y.to_bytes(32, "big")}
+    db.session.add(Passkey(
+        user_id=passkey_user.id, credential_id=CREDENTIAL_ID, public_key=cbor2.dumps(cose_key), sign_count=0,
+    ))
+    db.session.commit()
+    return passkey_user.id
+
+
+def fake_oauth_response(url, **kwargs):
+    """Google / LINE のトークン・プロフィールAPIの代わりに固定の応答を返す"""
+    if "token" in url:
+        body = {"access_token": "bench-access-token"}
+    elif "googleapis" in url:
+        body = {"id": "g-1", "email": "google@example.com", "name": "Google User"}
+    else:
+        body = {"userId": "l-1", "displayName": "LINE User"}
+    response = mock.Mock()
+    response.json.return_value = body
+    return response
+
+
+def make_password_login(cost):
+    def request(client):
+        # 設定のコストと異なるとログイン時に作り直されるため、ユーザーのコストに合わせる
+        client.application.config["BCRYPT_LOG_ROUNDS"] = cost
+        response = client.post("/api/login", json={"username": f"user{cost}", "password": "password"})
+        assert response.status_code == 200, response.data
+    return request
+
+
+def make_passkey_login(private_key):
+    def request(client):
+        options = client.post("/api/login/options", json={"username": "passkey"}).get_json()
+        client_data = json.dumps({
+            "type": "webauthn.get", "challenge": options["challenge"], "origin": ORIGIN, "crossOrigin": False,
+        }).encode()
+        # rpIdHash + フラグ（UP, UV）+ 署名カウンタ 0
+        authenticator_data = hashlib.sha256(b"localhost").digest() + b"\x05" + (0).to_bytes(4, "big")
+        signature = private_key.sign(
+            authenticator_data + hashlib.sha256(client_data).digest(), ec.ECDSA(hashes.SHA256())
+        )
+        response = client.post("/api/login/verify", headers={"Origin": ORIGIN}, json={
+            "id": CREDENTIAL_ID, "rawId": CREDENTIAL_ID, "type": "public-key",
+            "response": {
+                "clientDataJSON": b64url(client_data),
+                "authenticatorData": b64url(authenticator_data),
+                "signature": b64url(signature),
+            },
+        })
+        assert response.status_code == 200, response.data
+    return request
+
+
+def make_jwt_read(user_id):
+    token = jwt.encode(
+        {"user_id": user_id, "exp": datetime.now(timezone.utc) + timedelta(hours=1)}, SECRET_KEY, algorithm="HS256"
+    )
+
+    def request(client):
+        response = client.get("/api/account/data", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.data
+    return request
+
+
+def make_oauth_login(provider):
+    def request(client):
+        response = client.post(f"/api/auth/{provider}", json={"code": "bench-code"})
+        assert response.status_code == 200, response.data
+    return request
+
+
+def run_case(app, request, concurrency):
+    """concurrency 本のスレッドで DURATION 秒間 request を繰り返す"""
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + DURATION
+
+    def worker():
+        client = app.test_client()
+        local = []
+        while time.perf_counter() < deadline or len(local) * concurrency < MIN_REQUESTS:
+            start = time.perf_counter()
+            with app.app_context():
+                request(client)
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return len(latencies) / elapsed, statistics.median(latencies), p99
+
+
+def main():
+    from app import api_routes, oauth
+
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_bench_app(tmp)
+        with app.app_context():
+            passkey_user_id = seed(private_key)
+
+        cases = [(f"password login (cost {cost})", make_password_login(cost)) for cost in BCRYPT_COSTS]
+        cases += [
+            ("passkey login", make_passkey_login(private_key)),
+            ("jwt read (user cache)", make_jwt_read(passkey_user_id)),
+            ("jwt read (no user cache)", make_jwt_read(passkey_user_id)),
+            ("oauth google", make_oauth_login("google")),
+            ("oauth line", make_oauth_login("line")),
+        ]
+
+        print(f"パスワード処理プロセス数 {app.config['PASSWORD_POOL_WORKERS']}, 各ケース {DURATION:.0f} 秒")
+        print(f"{'case':<28} {'threads':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        print("-" * 66)
+        # get_rp_id() などのデバッグ出力を抑止する
+        with contextlib.redirect_stdout(io.StringIO()) as quiet, \
+                mock.patch.object(oauth.requests, "post", side_effect=fake_oauth_response), \
+                mock.patch.object(oauth.requests, "get", side_effect=fake_oauth_response):
+            for label, request in cases:
+                maxsize = api_routes.user_cache.maxsize
+                if label == "jwt read (no user cache)":
+                    api_routes.user_cache.maxsize = 0
+                    api_routes.user_cache.invalidate()
+                try:
+                    for concurrency in CONCURRENCY:
+                        rps, p50, p99 = run_case(app, request, concurrency)
+                        print(f"{label:<28} {concurrency:>7} {rps:>9.1f} {p50:>9.2f} {p99:>9.2f}", file=sys.__stdout__)
+                finally:
+                    api_routes.user_cache.maxsize = maxsize
+                quiet.seek(0)
+                quiet.truncate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+お祭り一覧の開催日絞り込み（?from=&to=）のベンチマーク
+
+festivals テーブルの件数を増やしながら、一致件数が一定（MATCHING_ROWS 件）の
+期間検索にかかる時間と SQLite の実行計画を ix_festivals_date の有無で比較する。
+インデックスありでは件数に関わらず時間がほぼ一定になることを確認する。
+
+backendディレクトリから実行することを想定:
+    python benchmarks/bench_festival_date_range.py
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, text
+from app import db
+from app.models import Festivals
+
+TABLE_SIZES = [1_000, 10_000, 100_000]
+MATCHING_ROWS = 50
+REPEAT = 50
+RANGE_FROM = date(2026, 8, 1)
+RANGE_TO = date(2026, 8, 15)
+
+
+def create_bench_app(db_path):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{db_path}", SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    return app
+
+
+def seed(size):
+    """期間内に MATCHING_ROWS 件、残りは期間外（1990〜2025年）に散らばるデータを作る"""
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(size)
+    span = (RANGE_TO - RANGE_FROM).days
+    rows = []
+    for i in range(size):
+        if i < MATCHING_ROWS:
+            d = RANGE_FROM + timedelta(days=rng.randint(0, span))
+        else:
+            d = date(1990, 1, 1) + timedelta(days=rng.randint(0, 365 * 35))
+        rows.append({"name": f"祭{i}", "date": d, "location": "長野県", "latitude": 36.0, "longitude": 138.0})
+    db.session.execute(Festivals.__table__.insert(), rows)
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+
+
+def capture_festival_query(build_festival_list):
+    """build_festival_list が発行する festivals への SELECT 文を取得する"""
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if "FROM festivals" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", on_execute)
+    try:
+        build_festival_list({"name", "date"}, date_from=RANGE_FROM, date_to=RANGE_TO)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_execute)
+    return statements[0]
+
+
+def run_case(build_festival_list):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = build_festival_list({"name", "date"}, date_from=RANGE_FROM, date_to=RANGE_TO)
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.rollback()
+    assert len(result) == MATCHING_ROWS
+
+    statement, parameters = capture_festival_query(build_festival_list)
+    with db.engine.connect() as conn:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    return statistics.median(timings), max(timings), " / ".join(row[-1] for row in plan)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_bench_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            from app.api_routes import build_festival_list
+
+            print(f"期間 {RANGE_FROM}〜{RANGE_TO}（一致 {MATCHING_ROWS} 件）, {REPEAT} 回の中央値/最大")
+            print(f"{'rows':>8} {'index':<6} {'median ms':>10} {'max ms':>8}  plan")
+            print("-" * 90)
+            for size in TABLE_SIZES:
+                seed(size)
+                for with_index in (True, False):
+                    if not with_index:
+                        db.session.execute(text("DROP INDEX ix_festivals_date"))
+                        db.session.commit()
+                    median, worst, plan = run_case(build_festival_list)
+                    print(f"{size:>8} {'yes' if with_index else 'no':<6} {median:>10.3f} {worst:>8.3f}  {plan}")
+
+
+if __name__ == "__main__":
+    main()
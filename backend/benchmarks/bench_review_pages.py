@@ -0,0 +1,108 @@
+"""
+お祭りのレビュー一覧のページング（?limit=&before=）のベンチマーク
+
+1つのお祭りのレビュー件数を増やしながら、先頭ページと末尾付近のページ（before カーソル指定）の
+取得時間を計測し、ix_reviews_festival_id_created_at の有無で比較する。
+インデックスありではレビュー件数に関わらず1ページの取得時間がほぼ一定になることを確認する。
+
+backendディレクトリから実行することを想定:
+    python benchmarks/bench_review_pages.py
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import text
+from app import db
+from app.models import Festivals, Review, User
+
+REVIEW_COUNTS = [1_000, 10_000, 100_000]
+OTHER_FESTIVALS = 20
+PAGE_SIZE = 20
+REPEAT = 50
+
+
+def create_bench_app(tmp):
+    # instance 以下に書き出すファイルも一時ディレクトリに置く
+    app = Flask(__name__, instance_path=tmp)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}", SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    return app
+
+
+def seed(count):
+    """対象のお祭り（id=1）に count 件、他のお祭りにも同数ずつレビューを入れる"""
+    db.drop_all()
+    db.create_all()
+    db.session.add(User(id=1, userID="bench", username="bench"))
+    db.session.execute(Festivals.__table__.insert(), [{"name": f"祭{i}"} for i in range(OTHER_FESTIVALS + 1)])
+    rng = random.Random(count)
+    start = datetime(2020, 1, 1)
+    rows = []
+    for festival_id in range(1, OTHER_FESTIVALS + 2):
+        per_festival = count if festival_id == 1 else count // OTHER_FESTIVALS
+        for _ in range(per_festival):
+            rows.append({
+                "festival_id": festival_id, "user_id": 1, "rating": rng.randint(1, 5),
+                "created_at": start + timedelta(seconds=rng.randint(0, 86400 * 365 * 5)),
+            })
+    db.session.execute(Review.__table__.insert(), rows)
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+
+
+def fetch_page(client, before=None):
+    url = f"/api/festivals/1/reviews?limit={PAGE_SIZE}" + (f"&before={before}" if before else "")
+    start = time.perf_counter()
+    response = client.get(url)
+    elapsed = (time.perf_counter() - start) * 1000
+    assert response.status_code == 200 and len(response.get_json()) == PAGE_SIZE
+    return elapsed, len(response.data)
+
+
+def run_case(client):
+    # 末尾付近のページのカーソル（古い方から PAGE_SIZE * 2 件目）
+    row = db.session.execute(text(
+        "SELECT created_at, id FROM reviews WHERE festival_id = 1 ORDER BY created_at, id LIMIT 1 OFFSET :n"
+    ), {"n": PAGE_SIZE * 2}).one()
+    deep_cursor = f"{datetime.fromisoformat(str(row[0])).isoformat()},{row[1]}"
+
+    first, deep = [], []
+    for _ in range(REPEAT):
+        elapsed, size = fetch_page(client)
+        first.append(elapsed)
+        elapsed, _ = fetch_page(client, deep_cursor)
+        deep.append(elapsed)
+    return statistics.median(first), statistics.median(deep), size
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_bench_app(tmp)
+        from app.api_routes import api_bp
+        app.register_blueprint(api_bp, url_prefix="/api")
+        client = app.test_client()
+
+        with app.app_context():
+            print(f"1ページ {PAGE_SIZE} 件, {REPEAT} 回の中央値")
+            print(f"{'reviews':>8} {'index':<6} {'first ms':>9} {'deep ms':>9} {'bytes':>7}")
+            print("-" * 46)
+            for count in REVIEW_COUNTS:
+                seed(count)
+                for with_index in (True, False):
+                    if not with_index:
+                        db.session.execute(text("DROP INDEX ix_reviews_festival_id_created_at"))
+                        db.session.commit()
+                    first, deep, size = run_case(client)
+                    print(f"{count:>8} {'yes' if with_index else 'no':<6} {first:>9.3f} {deep:>9.3f} {size:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+レビュー取得APIの発行クエリ数の計測
+
+1つのお祭りのレビュー一覧（/api/festivals/<id>/reviews）と複数お祭りの一括取得（/api/reviews）について、
+レビュー件数・投稿者数を増やしながら発行される SQL の数と応答時間を計測する。
+投稿者名はJOINで読み込むため、クエリ数がレビュー件数に関わらず一定であることを確認する（一定でなければ終了コード1）。
+
+backendディレクトリから実行することを想定:
+    python benchmarks/bench_review_queries.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from app import cache, db
+from app.models import Festivals, Review, User
+
+REVIEW_COUNTS = [10, 100, 500, 2_000]
+FESTIVALS = 10
+USERS = 200
+BATCH_LIMIT = 50
+
+
+def create_bench_app(tmp):
+    # instance 以下に書き出すファイルも一時ディレクトリに置く
+    app = Flask(__name__, instance_path=tmp)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}", SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # 計測中にバージョンのスナップショットを読み直さない
+        DATA_VERSION_TTL=3600,
+    )
+    db.init_app(app)
+    from app.api_routes import api_bp
+    app.register_blueprint(api_bp, url_prefix="/api")
+    return app
+
+
+def seed(count):
+    """各お祭りに count 件ずつ、USERS 人の投稿者からのレビューを入れる"""
+    db.drop_all()
+    db.create_all()
+    db.session.execute(User.__table__.insert(), [
+        {"id": i, "userID": f"user{i}", "username": f"ユーザー{i}"} for i in range(1, USERS + 1)
+    ])
+    db.session.execute(Festivals.__table__.insert(), [{"id": i, "name": f"祭{i}"} for i in range(1, FESTIVALS + 1)])
+    rng = random.Random(count)
+    start = datetime(2020, 1, 1)
+    db.session.execute(Review.__table__.insert(), [
+        {
+            "festival_id": festival_id, "user_id": rng.randint(1, USERS), "rating": rng.randint(1, 5),
+            "created_at": start + timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+        }
+        for festival_id in range(1, FESTIVALS + 1) for _ in range(count)
+    ])
+    db.session.commit()
+
+
+def measure(client, url):
+    """url の取得で発行された SQL の数と応答時間(ms)"""
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # ETag に使う epoch の初回作成とバージョンの読み込みは数えない
+    cache.get_epoch()
+    db.session.remove()
+    event.listen(db.engine, "before_cursor_execute", on_execute)
+    try:
+        start = time.perf_counter()
+        response = client.get(url)
+        elapsed = (time.perf_counter() - start) * 1000
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_execute)
+    assert response.status_code == 200, response.data
+    return len(statements), elapsed, response.get_json()
+
+
+def main():
+    ids = ",".join(str(i) for i in range(1, FESTIVALS + 1))
+    cases = [
+        ("single", "/api/festivals/1/reviews"),
+        ("single page", "/api/festivals/1/reviews?limit=50"),
+        ("batch", f"/api/reviews?festival_ids={ids}&limit={BATCH_LIMIT}"),
+    ]
+    query_counts = {label: set() for label, _ in cases}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_bench_app(tmp)
+        client = app.test_client()
+        with app.app_context():
+            print(f"{'reviews/festival':>16} {'case':<12} {'returned':>8} {'queries':>8} {'ms':>8}")
+            print("-" * 58)
+            for count in REVIEW_COUNTS:
+                seed(count)
+                for label, url in cases:
+                    queries, elapsed, body = measure(client, url)
+                    returned = sum(len(v) for v in body.values()) if isinstance(body, dict) else len(body)
+                    assert all("ユーザー" in r["username"] for r in (body["1"] if isinstance(body, dict) else body))
+                    query_counts[label].add(queries)
+                    print(f"{count:>16} {label:<12} {returned:>8} {queries:>8} {elapsed:>8.2f}")
+
+    constant = all(len(counts) == 1 for counts in query_counts.values())
+    print(f"\nクエリ数がレビュー件数に依存しない: {'OK' if constant else 'NG'}")
+    sys.exit(0 if constant else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+入力補完（/api/festivals/suggest）のマイクロベンチマーク
+
+合成したお祭り名と読み仮名 NAMES 件からトライ木を作り、ランダムな接頭辞（1〜4文字）での
+候補取得のレイテンシを計測する。比較として SQLite の LIKE 'prefix%' 検索も計測する。
+
+目標: 50,000件で1回の候補取得の p99 が TARGET_P99_MS 以下
+
+backendディレクトリから実行することを想定:
+    python benchmarks/bench_suggest.py
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.search import PrefixTrie, normalize
+
+NAMES = 50_000
+QUERIES = 5_000
+TARGET_P99_MS = 1.0
+
+TOWNS = [
+    ("諏訪", "すわ"), ("松本", "まつもと"), ("長野", "ながの"), ("上田", "うえだ"), ("飯田", "いいだ"),
+    ("伊那", "いな"), ("佐久", "さく"), ("小諸", "こもろ"), ("安曇野", "あづみの"), ("木曽", "きそ"),
+    ("大町", "おおまち"), ("茅野", "ちの"), ("岡谷", "おかや"), ("塩尻", "しおじり"), ("千曲", "ちくま"),
+]
+KINDS = [
+    ("祭", "まつり"), ("花火大会", "はなびたいかい"), ("盆踊り", "ぼんおどり"), ("夏祭り", "なつまつり"),
+    ("秋祭り", "あきまつり"), ("灯篭祭", "とうろうまつり"), ("ふるさとまつり", "ふるさとまつり"), ("太鼓祭", "たいこまつり"),
+]
+
+
+def make_festivals(count):
+    rng = random.Random(0)
+    festivals = []
+    for i in range(count):
+        town, town_kana = rng.choice(TOWNS)
+        kind, kind_kana = rng.choice(KINDS)
+        suffix = f"第{i}回"
+        festivals.append((i + 1, f"{town}{kind}{suffix}", f"{town_kana}{kind_kana}", rng.randint(0, 100_000)))
+    return festivals
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench_trie(festivals, prefixes):
+    start = time.perf_counter()
+    trie = PrefixTrie()
+    for fid, name, kana, attendance in festivals:
+        trie.add(fid, [normalize(name), normalize(kana)], (-attendance, name), {"id": fid, "name": name})
+    trie.compute_top()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    timings = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        trie.suggest(normalize(prefix))
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # お祭りの更新はキャッシュの apply_update と同じく、コピーに反映（削除→追加）して経路上の上位候補を再計算する
+    update_timings = []
+    for fid, name, kana, attendance in festivals[:200]:
+        start = time.perf_counter()
+        trie = trie.copy()
+        trie.add(fid, [normalize(name), normalize(kana)], (-attendance - 1, name), {"id": fid, "name": name})
+        trie.compute_top()
+        trie.suggest(normalize(name[:2]))
+        update_timings.append((time.perf_counter() - start) * 1000)
+    return build_ms, timings, update_timings
+
+
+def bench_like(festivals, prefixes):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE festivals (id INTEGER PRIMARY KEY, name TEXT, name_kana TEXT, attendance INTEGER)")
+    conn.executemany("INSERT INTO festivals VALUES (?, ?, ?, ?)", festivals)
+    timings = []
+    for prefix in prefixes[:500]:
+        start = time.perf_counter()
+        conn.execute(
+            "SELECT id, name FROM festivals WHERE name LIKE ? OR name_kana LIKE ? ORDER BY attendance DESC LIMIT 10",
+            (prefix + "%", prefix + "%"),
+        ).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    return timings
+
+
+def main():
+    festivals = make_festivals(NAMES)
+    rng = random.Random(1)
+    prefixes = []
+    for _ in range(QUERIES):
+        _, name, kana, _ = rng.choice(festivals)
+        key = rng.choice([name, kana])
+        prefixes.append(key[:rng.randint(1, 4)])
+
+    build_ms, trie_timings, update_timings = bench_trie(festivals, prefixes)
+    like_timings = bench_like(festivals, prefixes)
+
+    print(f"{NAMES}件, 接頭辞 {QUERIES} 回（1〜4文字）")
+    print(f"trie 構築: {build_ms:.1f} ms")
+    print(f"{'':<24} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    print("-" * 52)
+    for label, timings in (("trie suggest", trie_timings), ("trie 更新直後の suggest", update_timings), ("SQLite LIKE scan", like_timings)):
+        print(f"{label:<24} {statistics.median(timings):>8.4f} {percentile(timings, 0.99):>8.4f} {max(timings):>8.4f}")
+
+    p99 = percentile(trie_timings, 0.99)
+    print(f"\n目標 p99 <= {TARGET_P99_MS} ms: {'OK' if p99 <= TARGET_P99_MS else 'NG'} ({p99:.4f} ms)")
+
+
+if __name__ == "__main__":
+    main()
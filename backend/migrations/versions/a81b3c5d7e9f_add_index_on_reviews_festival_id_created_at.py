@@ -0,0 +1,26 @@
+"""Add index on reviews (festival_id, created_at)
+
+Revision ID: a81b3c5d7e9f
+Revises: f7a02b4d5e6c
+Create Date: 2026-10-17 17:02:45.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a81b3c5d7e9f'
+down_revision = 'f7a02b4d5e6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.create_index('ix_reviews_festival_id_created_at', ['festival_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.drop_index('ix_reviews_festival_id_created_at')
@@ -0,0 +1,39 @@
+"""Add festival_photo_variants table
+
+Revision ID: c03d5e7f9a1b
+Revises: b92c4d6e8f0a
+Create Date: 2026-10-17 18:54:12.309861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c03d5e7f9a1b'
+down_revision = 'b92c4d6e8f0a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('festival_photo_variants',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('photo_id', sa.Integer(), nullable=False),
+    sa.Column('size', sa.String(length=10), nullable=False),
+    sa.Column('format', sa.String(length=10), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=False),
+    sa.Column('height', sa.Integer(), nullable=False),
+    sa.Column('image_url', sa.String(length=255), nullable=False),
+    sa.ForeignKeyConstraint(['photo_id'], ['festival_photos.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('festival_photo_variants', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_festival_photo_variants_photo_id'), ['photo_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('festival_photo_variants', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_festival_photo_variants_photo_id'))
+
+    op.drop_table('festival_photo_variants')
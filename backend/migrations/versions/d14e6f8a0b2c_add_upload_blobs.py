@@ -0,0 +1,39 @@
+"""Add upload_blobs table and festival_photos.content_hash
+
+Revision ID: d14e6f8a0b2c
+Revises: c03d5e7f9a1b
+Create Date: 2026-10-17 20:12:41.582013
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd14e6f8a0b2c'
+down_revision = 'c03d5e7f9a1b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_blobs',
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('content_hash')
+    )
+    # 既存の写真（UUID名のファイル）は content_hash なしのまま、削除時にファイルを直接消す
+    with op.batch_alter_table('festival_photos', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_festival_photos_content_hash'), ['content_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('festival_photos', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_festival_photos_content_hash'))
+        batch_op.drop_column('content_hash')
+
+    op.drop_table('upload_blobs')
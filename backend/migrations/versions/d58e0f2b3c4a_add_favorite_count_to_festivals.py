@@ -0,0 +1,32 @@
+"""Add favorite_count to festivals
+
+Revision ID: d58e0f2b3c4a
+Revises: c47d9e1a2b3f
+Create Date: 2026-10-17 14:20:07.903115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58e0f2b3c4a'
+down_revision = 'c47d9e1a2b3f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('festivals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+
+    # 既存のお気に入り件数を反映
+    op.execute(
+        "UPDATE festivals SET favorite_count = "
+        "(SELECT COUNT(*) FROM user_favorites WHERE user_favorites.festival_id = festivals.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('festivals', schema=None) as batch_op:
+        batch_op.drop_column('favorite_count')
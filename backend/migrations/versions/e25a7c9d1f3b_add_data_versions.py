@@ -0,0 +1,30 @@
+"""Add data_versions table
+
+Revision ID: e25a7c9d1f3b
+Revises: d14e6f8a0b2c
+Create Date: 2026-10-17 22:04:18.316540
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e25a7c9d1f3b'
+down_revision = 'd14e6f8a0b2c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 行はアプリが最初の更新時に作る（instance/data_versions のカウンタは引き継がず、epoch も作り直す）
+    op.create_table('data_versions',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('data_versions')
@@ -0,0 +1,42 @@
+"""Add rating aggregates to festivals
+
+Revision ID: e69f1a3c4d5b
+Revises: d58e0f2b3c4a
+Create Date: 2026-10-17 15:02:48.120376
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e69f1a3c4d5b'
+down_revision = 'd58e0f2b3c4a'
+branch_labels = None
+depends_on = None
+
+RATING_COLUMNS = ['rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+
+
+def upgrade():
+    with op.batch_alter_table('festivals', schema=None) as batch_op:
+        for column in RATING_COLUMNS:
+            batch_op.add_column(sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+
+    # 既存のレビューから集計を反映
+    op.execute(
+        "UPDATE festivals SET "
+        "rating_count = (SELECT COUNT(*) FROM reviews WHERE reviews.festival_id = festivals.id AND reviews.rating BETWEEN 1 AND 5), "
+        "rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews WHERE reviews.festival_id = festivals.id AND reviews.rating BETWEEN 1 AND 5)"
+    )
+    for rating in range(1, 6):
+        op.execute(
+            f"UPDATE festivals SET rating_{rating} = "
+            f"(SELECT COUNT(*) FROM reviews WHERE reviews.festival_id = festivals.id AND reviews.rating = {rating})"
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('festivals', schema=None) as batch_op:
+        for column in reversed(RATING_COLUMNS):
+            batch_op.drop_column(column)
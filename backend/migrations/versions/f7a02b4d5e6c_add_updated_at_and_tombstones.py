@@ -0,0 +1,50 @@
+"""Add festivals.updated_at and tombstones table
+
+Revision ID: f7a02b4d5e6c
+Revises: e69f1a3c4d5b
+Create Date: 2026-10-17 16:11:30.552914
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a02b4d5e6c'
+down_revision = 'e69f1a3c4d5b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('festivals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_festivals_updated_at'), ['updated_at'], unique=False)
+
+    # 既存のお祭りは移行時点で更新されたものとして扱う。アプリは datetime.utcnow() で書き込むため、
+    # DB の CURRENT_TIMESTAMP（MySQL ではサーバーのタイムゾーン）ではなく Python 側の UTC を入れる
+    festivals = sa.table('festivals', sa.column('updated_at', sa.DateTime()))
+    op.execute(festivals.update().values(updated_at=datetime.utcnow()))
+
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('record_id', sa.Integer(), nullable=False),
+    sa.Column('festival_id', sa.Integer(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tombstones', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_tombstones_deleted_at'), ['deleted_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tombstones', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tombstones_deleted_at'))
+
+    op.drop_table('tombstones')
+
+    with op.batch_alter_table('festivals', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_festivals_updated_at'))
+        batch_op.drop_column('updated_at')
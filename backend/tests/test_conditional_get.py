@@ -0,0 +1,88 @@
+"""
+ETag が一致する条件付き GET（If-None-Match）が DB に問い合わせずに 304 を返すことの確認
+
+backendディレクトリから実行する:
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import date
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import cache, db
+from app.models import Festivals, Review, SiteSettings, User
+
+URLS = [
+    "/api/festivals",
+    "/api/festivals?fields=id,name",
+    "/api/festivals/1/ics",
+    "/api/festivals/1/reviews",
+    "/api/festivals/1/reviews/summary",
+    "/api/reviews?festival_ids=1",
+    "/api/admin/settings",
+]
+
+
+@pytest.fixture
+def app(tmp_path):
+    # instance 以下に書き出すファイルも一時ディレクトリに置く
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}", SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # 計測中にバージョンのスナップショットを読み直さない
+        DATA_VERSION_TTL=3600,
+    )
+    db.init_app(app)
+    from app.api_routes import api_bp
+    app.register_blueprint(api_bp, url_prefix="/api")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(id=1, userID="user1", username="ユーザー1"))
+        db.session.add(Festivals(id=1, name="祭", date=date(2026, 8, 1)))
+        db.session.add(Review(festival_id=1, user_id=1, rating=4))
+        db.session.add(SiteSettings(id=1))
+        db.session.commit()
+        yield app
+
+
+def get_counting(client, url, headers=None):
+    """url を取得し、(レスポンス, 発行された SQL の数) を返す"""
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db.session.remove()
+    event.listen(db.engine, "before_cursor_execute", on_execute)
+    try:
+        response = client.get(url, headers=headers or {})
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_execute)
+    return response, len(statements)
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_not_modified_without_queries(app, url):
+    client = app.test_client()
+    response = client.get(url)
+    assert response.status_code == 200, response.data
+    etag = response.headers["ETag"]
+
+    response, queries = get_counting(client, url, {"If-None-Match": etag})
+    assert response.status_code == 304
+    assert queries == 0
+
+
+def test_etag_changes_after_bump(app):
+    client = app.test_client()
+    etag = client.get("/api/festivals").headers["ETag"]
+    cache.bump_version(cache.FESTIVALS)
+    response = client.get("/api/festivals", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
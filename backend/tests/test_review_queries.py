@@ -0,0 +1,88 @@
+"""
+レビュー取得APIの発行クエリ数がレビュー件数に依存しないこと（投稿者の N+1 が起きていないこと）の確認
+
+backendディレクトリから実行する:
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import cache, db
+from app.models import Festivals, Review, User
+
+FESTIVALS = 3
+MANY = 30
+
+CASES = {
+    "single": "/api/festivals/1/reviews",
+    "single page": "/api/festivals/1/reviews?limit=10",
+    "batch": f"/api/reviews?festival_ids={','.join(str(i) for i in range(1, FESTIVALS + 1))}&limit=10",
+}
+
+
+@pytest.fixture
+def app(tmp_path):
+    # instance 以下に書き出すファイルも一時ディレクトリに置く
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}", SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # 計測中にバージョンのスナップショットを読み直さない
+        DATA_VERSION_TTL=3600,
+    )
+    db.init_app(app)
+    from app.api_routes import api_bp
+    app.register_blueprint(api_bp, url_prefix="/api")
+    with app.app_context():
+        yield app
+
+
+def seed(count):
+    """各お祭りに count 件ずつ、別々の投稿者からのレビューを入れる"""
+    db.drop_all()
+    db.create_all()
+    db.session.execute(User.__table__.insert(), [
+        {"id": i, "userID": f"user{i}", "username": f"ユーザー{i}"} for i in range(1, count + 1)
+    ])
+    db.session.execute(Festivals.__table__.insert(), [{"id": i, "name": f"祭{i}"} for i in range(1, FESTIVALS + 1)])
+    start = datetime(2020, 1, 1)
+    db.session.execute(Review.__table__.insert(), [
+        {"festival_id": festival_id, "user_id": i, "rating": 3, "created_at": start + timedelta(minutes=i)}
+        for festival_id in range(1, FESTIVALS + 1) for i in range(1, count + 1)
+    ])
+    db.session.commit()
+
+
+def count_queries(client, url):
+    """url の取得で発行された SQL の数"""
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # ETag に使う epoch の初回作成とバージョンの読み込みは数えない
+    cache.get_epoch()
+    db.session.remove()
+    event.listen(db.engine, "before_cursor_execute", on_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_execute)
+    assert response.status_code == 200, response.data
+    return len(statements)
+
+
+@pytest.mark.parametrize("url", CASES.values(), ids=CASES.keys())
+def test_query_count_does_not_grow_with_reviews(app, url):
+    client = app.test_client()
+    seed(1)
+    one = count_queries(client, url)
+    seed(MANY)
+    many = count_queries(client, url)
+    assert one == many
@@ -0,0 +1,90 @@
+"""
+認証済みユーザーのキャッシュ（api_routes.user_cache）で、キャッシュ済みのリクエストが
+users にも data_versions にも問い合わせないこと、ユーザーの更新後は読み直すことの確認
+
+backendディレクトリから実行する:
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import cache, db
+from app.models import User
+
+SECRET_KEY = "test-secret-key-that-is-long-enough-for-hs256"
+
+
+@pytest.fixture
+def app(tmp_path):
+    # instance 以下に書き出すファイルも一時ディレクトリに置く
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}", SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECRET_KEY=SECRET_KEY,
+        # 計測中にバージョンのスナップショットを読み直さない
+        DATA_VERSION_TTL=3600,
+    )
+    db.init_app(app)
+    from app.api_routes import api_bp, user_cache
+    app.register_blueprint(api_bp, url_prefix="/api")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(id=1, userID="admin", username="管理者", is_admin=True))
+        db.session.commit()
+        user_cache.invalidate()
+        yield app
+
+
+def auth_headers(user_id):
+    token = jwt.encode(
+        {"user_id": user_id, "exp": datetime.now(timezone.utc) + timedelta(hours=1)}, SECRET_KEY, algorithm="HS256",
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+def get_counting(client, url, headers):
+    """url を取得し、(レスポンス, 発行された SQL のリスト) を返す"""
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db.session.remove()
+    event.listen(db.engine, "before_cursor_execute", on_execute)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_execute)
+    return response, statements
+
+
+def test_cached_user_skips_queries(app):
+    client = app.test_client()
+    headers = auth_headers(1)
+    response, statements = get_counting(client, "/api/admin/cache-stats", headers)
+    assert response.status_code == 200
+    assert any("FROM users" in s for s in statements)
+
+    response, statements = get_counting(client, "/api/admin/cache-stats", headers)
+    assert response.status_code == 200
+    assert statements == []
+
+
+def test_user_update_invalidates_cache(app):
+    client = app.test_client()
+    headers = auth_headers(1)
+    assert client.get("/api/admin/cache-stats", headers=headers).status_code == 200
+
+    db.session.get(User, 1).is_admin = False
+    db.session.commit()
+    cache.bump_version(cache.USERS)
+    assert client.get("/api/admin/cache-stats", headers=headers).status_code == 403
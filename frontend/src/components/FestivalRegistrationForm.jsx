@@ -5,6 +5,7 @@ import { TextInput, Textarea, NumberInput, Button, Box, Stack, Alert } from '@ma
 
 const INITIAL_STATE = {
   name: '',
+  name_kana: '',
   date: '',
   location: '',
   description: '',
@@ -66,6 +67,7 @@ function FestivalRegistrationForm({ onFestivalAdded, festivalData }) {
       <form onSubmit={form.onSubmit(handleSubmit)}>
         <Stack>
           <TextInput label="お祭り名" placeholder="お祭り名を入力" withAsterisk {...form.getInputProps('name')} />
+          <TextInput label="ふりがな" placeholder="検索候補に使う読みを入力（例: すわこまつり）" {...form.getInputProps('name_kana')} />
           <TextInput type="date" label="開催日" placeholder="開催日を選択" withAsterisk {...form.getInputProps('date')} />
           <TextInput label="開催場所" placeholder="開催場所を入力" withAsterisk {...form.getInputProps('location')} />
           <TextInput label="画像URL" placeholder="https://example.com/image.jpg" {...form.getInputProps('image_url')} />
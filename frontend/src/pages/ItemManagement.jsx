@@ -4,7 +4,7 @@ import { Container, Title, Table, Alert, Text, Modal, Button, Group, ActionIcon,
 import { useDisclosure } from '@mantine/hooks';
 import { modals } from '@mantine/modals';
 import { IconEdit, IconTrash, IconPlus, IconMinus, IconChevronUp, IconChevronDown, IconSelector } from '@tabler/icons-react';
-import { getFestivals, deleteFestival, createFestival, updateFestival, uploadFestivalPhoto, deleteFestivalPhoto, getImageUrl } from '../utils/apiService';
+import { getFestivals, deleteFestival, createFestival, updateFestival, uploadFestivalPhotos, deleteFestivalPhoto, getImageUrl } from '../utils/apiService';
 import useApiData from '../hooks/useApiData';
 import BackButton from '../utils/BackButton';
 import '../css/GlassStyle.css';
@@ -225,7 +225,11 @@ function ItemManagement() {
 
         // 画像が選択されていればアップロードを実行
         if (photoFiles && photoFiles.length > 0 && festivalId) {
-          await Promise.all(photoFiles.map((file) => uploadFestivalPhoto(festivalId, file)));
+          const res = await uploadFestivalPhotos(festivalId, photoFiles);
+          const failed = res.data.results.filter((result) => result.error);
+          if (failed.length > 0) {
+            throw new Error(failed.map((result) => `${result.filename}: ${result.error}`).join(' / '));
+          }
         }
         refetch();
         close();
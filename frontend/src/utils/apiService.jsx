@@ -57,14 +57,26 @@ export const uploadFestivalPhoto = (festivalId, file) => {
   });
 };
 
+// 複数の画像を1回のリクエストでアップロード（結果はファイルごとに results で返る）
+export const uploadFestivalPhotos = (festivalId, files) => {
+  const formData = new FormData();
+  files.forEach((file) => formData.append('photos', file));
+  return apiClient.post(`/festivals/${festivalId}/photos/batch`, formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data',
+    },
+  });
+};
+
 // Festival Photo Delete API (画像削除用)
 export const deleteFestivalPhoto = (photoId) => {
   return apiClient.delete(`/photos/${photoId}`);
 };
 
 // Review API
-export const getReviewsForFestival = (festivalId) => {
-  return apiClient.get(`/festivals/${festivalId}/reviews`);
+// 新しい順に1ページずつ取得する。次のページは response.headers['x-next-cursor'] を before に渡す（最後のページではヘッダーなし）
+export const getReviewsForFestival = (festivalId, { limit, before } = {}) => {
+  return apiClient.get(`/festivals/${festivalId}/reviews`, { params: { limit, before } });
 };
 
 export const postReview = async (festivalId, reviewData) => {
@@ -160,4 +172,14 @@ export const getImageUrl = (url) => {
   if (url.startsWith('http')) return url; // 既に絶対URLの場合はそのまま返す
   const imageBaseUrl = process.env.REACT_APP_IMAGE_BASE_URL || '';
   return imageBaseUrl + url;
-};
\ No newline at end of file
+};
+
+// 写真の縮小版から <img srcset> 用の文字列を生成する（縮小版がなければ undefined）
+export const getImageSrcSet = (photo) => {
+  const srcset = photo && photo.srcset && (photo.srcset.webp || photo.srcset.jpeg);
+  if (!srcset) return undefined;
+  return srcset.split(', ').map((entry) => {
+    const [url, width] = entry.split(' ');
+    return `${getImageUrl(url)} ${width}`;
+  }).join(', ');
+};